@@ -0,0 +1,129 @@
+# Copyright (C) 2019-2022, Pyronear.
+
+# This program is licensed under the Apache License version 2.
+# See LICENSE or go to <https://www.apache.org/licenses/LICENSE-2.0.txt> for full license details.
+
+import cv2
+import time
+import tracemalloc
+import numpy as np
+from syntheticdataset.image_blending import (
+    BasicBlender,
+    basic_blending,
+    blend_clip,
+    _basic_blending_reference,
+)
+
+
+def make_frames(size, n_frames, bg_shape=(720, 1280), seed=0):
+    """Random backgrounds and smoke frames of size x size pixels"""
+    rng = np.random.RandomState(seed)
+    img = rng.randint(0, 256, bg_shape + (3,)).astype(np.uint8)
+
+    y, x = np.mgrid[:size, :size] / size - 0.5
+    blob = np.exp(-(x**2 + y**2) / 0.08)
+    smokes = [
+        (blob[:, :, None] * 255 * rng.uniform(0.6, 1, (size, size, 3))).astype(np.uint8)
+        for _ in range(n_frames)
+    ]
+
+    return img, smokes
+
+
+def measure(blend, img, smokes, offset):
+    """Time and allocated bytes per frame, the first frame is a warm up"""
+    blend(img, smokes[0], offset)
+
+    tracemalloc.start()
+    start = time.perf_counter()
+    for smoke in smokes[1:]:
+        blend(img, smoke, offset)
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    n = len(smokes) - 1
+    return 1000 * elapsed / n, peak / 1024**2
+
+
+def measure_clip(img, smokes, offset, chunk_size):
+    """Time per frame and allocated bytes of a clip blended by chunks"""
+    bgs = np.broadcast_to(img, (len(smokes),) + img.shape)
+    smokes = np.stack(smokes)
+
+    tracemalloc.start()
+    start = time.perf_counter()
+    results, _, _ = blend_clip(
+        bgs, smokes, offset, chunk_size=chunk_size, roi_mask=True
+    )
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return 1000 * elapsed / len(smokes), peak / 1024**2, results[0]
+
+
+def main(args):
+
+    blender = BasicBlender()
+    variants = {
+        "reference": lambda img, smoke, offset: _basic_blending_reference(
+            img, smoke, offset
+        ),
+        "full mask": lambda img, smoke, offset: basic_blending(img, smoke, offset),
+        "roi mask": lambda img, smoke, offset: basic_blending(
+            img, smoke, offset, roi_mask=True
+        ),
+        "blender": lambda img, smoke, offset: blender.blend(img, smoke, offset),
+    }
+
+    print(f"{'size':>6} {'variant':>10} {'ms/frame':>9} {'peak MB':>8} {'max dev':>8}")
+    for size in args.sizes:
+        img, smokes = make_frames(size, args.frames + 1)
+        offset = ((img.shape[0] - size) // 2, (img.shape[1] - size) // 2)
+        ref, _ = _basic_blending_reference(img.copy(), smokes[0], offset)
+        for name, blend in variants.items():
+            ms, peak = measure(blend, img.copy(), smokes, offset)
+            res, _ = blend(img.copy(), smokes[0], offset)
+            dev = np.abs(res.astype(int) - ref).max()
+            print(f"{size:>6} {name:>10} {ms:>9.3f} {peak:>8.2f} {dev:>8}")
+        # the results of the whole clip are allocated at once
+        for chunk_size in args.chunk_sizes:
+            ms, peak, res = measure_clip(img, smokes, offset, chunk_size)
+            dev = np.abs(res.astype(int) - ref).max()
+            name = f"clip {chunk_size}"
+            print(f"{size:>6} {name:>10} {ms:>9.3f} {peak:>8.2f} {dev:>8}")
+
+
+def parse_args():
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description="Time and memory of basic blending per frame",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+
+    parser.add_argument(
+        "--sizes",
+        nargs="+",
+        default=[128, 256, 512],
+        type=int,
+        help="smoke crop sizes",
+    )
+    parser.add_argument("--frames", default=50, type=int, help="number of frames")
+    parser.add_argument(
+        "--chunk-sizes",
+        nargs="+",
+        default=[8, 16],
+        type=int,
+        help="frames blended at once by blend_clip",
+    )
+
+    args = parser.parse_args()
+
+    return args
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    main(args)
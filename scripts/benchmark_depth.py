@@ -0,0 +1,139 @@
+# Copyright (C) 2019-2022, Pyronear.
+
+# This program is licensed under the Apache License version 2.
+# See LICENSE or go to <https://www.apache.org/licenses/LICENSE-2.0.txt> for full license details.
+
+import cv2
+import os
+import time
+from syntheticdataset.randomization.depth_estimation import (
+    MIDAS_HYBRID,
+    MIDAS_LARGE,
+    MIDAS_SMALL,
+    DepthEstimation,
+    export_model,
+)
+from syntheticdataset.utils import iter_video
+
+# exported file of each variant, None for the eager model
+VARIANTS = {
+    "eager": None,
+    "torchscript": "{}.pt",
+    "torchscript-int8": "{}.int8.pt",
+    "onnx": "{}.onnx",
+    "onnx-int8": "{}.int8.onnx",
+}
+
+
+def main(args):
+
+    frames = [
+        cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+        for frame in iter_video(args.video, size_max=args.size_max)
+    ][: args.frames]
+    h, w = frames[0].shape[:2]
+
+    print(
+        f"{'model':<12} {'variant':<17} {'startup (s)':>11} {'frames/s':>9} "
+        f"{'ms/batch':>9}"
+    )
+    for model_type in args.models:
+        for variant in args.variants:
+            model_path = None
+            if VARIANTS[variant] is not None:
+                model_path = os.path.join(
+                    args.export_dir, VARIANTS[variant].format(model_type)
+                )
+                if not os.path.isfile(model_path):
+                    os.makedirs(args.export_dir, exist_ok=True)
+                    export_model(
+                        model_path,
+                        model_type,
+                        input_shape=(
+                            args.input_size,
+                            args.input_size * w // h // 32 * 32,
+                        ),
+                        quantize=variant.endswith("int8"),
+                        hub_dir=args.hub_dir,
+                    )
+
+            start = time.perf_counter()
+            depth = DepthEstimation(
+                model_type,
+                num_threads=args.threads,
+                input_size=args.input_size,
+                hub_dir=args.hub_dir,
+                model_path=model_path,
+            )
+            startup = time.perf_counter() - start
+
+            # warm up
+            depth.estimate_depth_from_batch(frames[: args.batch_size], args.batch_size)
+            depth.reset_stats()
+            depth.estimate_depth_from_batch(frames, args.batch_size)
+            stats = depth.stats()
+
+            print(
+                f"{model_type:<12} {variant:<17} {startup:>11.2f} "
+                f"{stats['frames_per_s']:>9.2f} {stats['ms_per_batch']:>9.0f}"
+            )
+
+
+def parse_args():
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description="Startup time and throughput of the depth estimation variants",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+
+    parser.add_argument(
+        "--video", default="test/videos/test_bg.mp4", help="background video"
+    )
+    parser.add_argument(
+        "--models",
+        nargs="+",
+        default=[MIDAS_SMALL, MIDAS_HYBRID, MIDAS_LARGE],
+        choices=[MIDAS_SMALL, MIDAS_HYBRID, MIDAS_LARGE],
+        help="MiDaS models",
+    )
+    parser.add_argument(
+        "--variants",
+        nargs="+",
+        default=list(VARIANTS),
+        choices=list(VARIANTS),
+        help="eager model or exported ones, int8 ones are quantized",
+    )
+    parser.add_argument(
+        "--export-dir", default="depth_models", help="folder of the exported models"
+    )
+    parser.add_argument(
+        "--hub-dir",
+        default=None,
+        help="local clone of intel-isl/MiDaS to load the models offline",
+    )
+    parser.add_argument(
+        "--size-max", default=1280, type=int, help="largest side of the frames"
+    )
+    parser.add_argument(
+        "--input-size",
+        default=256,
+        type=int,
+        help="height of the network input, multiple of 32",
+    )
+    parser.add_argument("--frames", default=32, type=int, help="number of frames")
+    parser.add_argument(
+        "--batch-size", default=8, type=int, help="frames per forward pass"
+    )
+    parser.add_argument(
+        "--threads", default=None, type=int, help="number of CPU threads of torch"
+    )
+
+    args = parser.parse_args()
+
+    return args
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    main(args)
@@ -0,0 +1,196 @@
+# Copyright (C) 2019-2022, Pyronear.
+
+# This program is licensed under the Apache License version 2.
+# See LICENSE or go to <https://www.apache.org/licenses/LICENSE-2.0.txt> for full license details.
+
+import cv2
+import time
+import numpy as np
+from syntheticdataset.poisson_blending_utils import (
+    create_mask,
+    build_poisson_system,
+    poisson_blend,
+    poisson_blend_pyramid,
+    _build_poisson_system_loop,
+)
+
+
+def make_frame(size, bg_shape=(720, 1280), seed=0):
+    """Random background and a smoke plume shaped blob of size x size pixels"""
+    rng = np.random.RandomState(seed)
+    bg_shape = (max(bg_shape[0], size + 2), max(bg_shape[1], size + 2))
+    img = rng.randint(0, 256, bg_shape + (3,)).astype(np.uint8)
+    img = cv2.GaussianBlur(img, (0, 0), 3)
+
+    y, x = np.mgrid[:size, :size] / size - 0.5
+    blob = np.exp(-(x**2 + y**2) / 0.08)
+    smoke = (blob[:, :, None] * 255 * rng.uniform(0.6, 1, (size, size, 3))).astype(
+        np.uint8
+    )
+    smoke_mask = smoke[:, :, 0] > 50
+
+    offset = ((bg_shape[0] - size) // 2, (bg_shape[1] - size) // 2)
+    mask, src, offset_adj = create_mask(smoke_mask, img, smoke, offset=offset)
+
+    return mask, src, img.astype(np.float64), offset_adj
+
+
+def deviation(res, ref, mask, offset_adj):
+    """Max and mean absolute deviation of res from ref inside the smoke mask"""
+    ys, xs = np.nonzero(mask)
+    dev = np.abs(
+        ref[ys + offset_adj[0], xs + offset_adj[1]].astype(int)
+        - res[ys + offset_adj[0], xs + offset_adj[1]]
+    )
+
+    return dev.max(), dev.mean()
+
+
+def timeit(func, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+
+    return best
+
+
+def bench_assembly(args):
+
+    print(
+        f"{'size':>6} {'method':>7} {'loop (s)':>10} {'vectorized (s)':>15} {'speedup':>8}"
+    )
+    for size in args.sizes or [64, 128, 256]:
+        mask, src, img, offset_adj = make_frame(size)
+        for method in args.methods:
+            kwargs = dict(method=method, offset_adj=offset_adj)
+            vectorized = timeit(
+                lambda: build_poisson_system(
+                    mask, src, img, domain=args.domain, **kwargs
+                ),
+                args.repeat,
+            )
+            if size <= args.max_loop_size:
+                loop = timeit(
+                    lambda: _build_poisson_system_loop(mask, src, img, **kwargs), 1
+                )
+                print(
+                    f"{size:>6} {method:>7} {loop:>10.3f} {vectorized:>15.4f} {loop / vectorized:>7.1f}x"
+                )
+            else:
+                print(f"{size:>6} {method:>7} {'-':>10} {vectorized:>15.4f} {'-':>8}")
+
+
+def bench_solve(args):
+
+    print(
+        f"{'size':>6} {'sparse (s)':>11} {'fast (s)':>9} {'speedup':>8} {'max dev':>8} {'mean dev':>9}"
+    )
+    for size in args.sizes or [256, 512, 1024]:
+        mask, src, img, offset_adj = make_frame(size)
+        kwargs = dict(offset_adj=offset_adj)
+        sparse = timeit(
+            lambda: poisson_blend(
+                mask, src, img, method="normal", domain="mask", cache=None, **kwargs
+            ),
+            args.repeat,
+        )
+        fast = timeit(
+            lambda: poisson_blend(mask, src, img, method="fast", **kwargs), args.repeat
+        )
+
+        ref = poisson_blend(mask, src, img, method="normal", domain="mask", **kwargs)
+        res = poisson_blend(mask, src, img, method="fast", **kwargs)
+        dev_max, dev_mean = deviation(res, ref, mask, offset_adj)
+        print(
+            f"{size:>6} {sparse:>11.3f} {fast:>9.3f} {sparse / fast:>7.1f}x {dev_max:>8} {dev_mean:>9.2f}"
+        )
+
+
+def bench_pyramid(args):
+
+    print(
+        f"{'size':>6} {'levels':>6} {'refine':>6} {'time (s)':>9} {'speedup':>8} {'max dev':>8} {'mean dev':>9}"
+    )
+    for size in args.sizes or [256, 512, 1024]:
+        mask, src, img, offset_adj = make_frame(size)
+        kwargs = dict(method="normal", offset_adj=offset_adj)
+        exact = timeit(
+            lambda: poisson_blend(mask, src, img, domain="mask", cache=None, **kwargs),
+            args.repeat,
+        )
+        ref = poisson_blend(mask, src, img, domain="mask", **kwargs)
+        print(f"{size:>6} {0:>6} {'-':>6} {exact:>9.3f} {1:>7.1f}x {0:>8} {0:>9.2f}")
+
+        for levels in args.levels:
+            for refine_iters in args.refine_iters:
+                pyramid = lambda: poisson_blend_pyramid(
+                    mask, src, img, levels=levels, refine_iters=refine_iters, **kwargs
+                )
+                elapsed = timeit(pyramid, args.repeat)
+                dev_max, dev_mean = deviation(pyramid(), ref, mask, offset_adj)
+                print(
+                    f"{size:>6} {levels:>6} {refine_iters:>6} {elapsed:>9.3f} {exact / elapsed:>7.1f}x {dev_max:>8} {dev_mean:>9.2f}"
+                )
+
+
+BENCHMARKS = {
+    "assembly": bench_assembly,
+    "solve": bench_solve,
+    "pyramid": bench_pyramid,
+}
+
+
+def main(args):
+    BENCHMARKS[args.bench](args)
+
+
+def parse_args():
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description="Benchmark poisson blending",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+
+    parser.add_argument(
+        "--bench",
+        default="assembly",
+        choices=list(BENCHMARKS),
+        help="assembly: pixel loop vs vectorized, solve: sparse vs fast (DST) solver, "
+        "pyramid: multi-resolution vs exact solve",
+    )
+    parser.add_argument("--sizes", nargs="+", type=int, help="smoke crop sizes")
+    parser.add_argument(
+        "--methods", nargs="+", default=["normal", "mix"], help="blending methods"
+    )
+    parser.add_argument(
+        "--domain", default="rect", help="unknowns of the vectorized system"
+    )
+    parser.add_argument(
+        "--levels", nargs="+", default=[1, 2, 3], type=int, help="pyramid levels"
+    )
+    parser.add_argument(
+        "--refine-iters",
+        nargs="+",
+        default=[0, 10, 50],
+        type=int,
+        help="pyramid refinement iterations",
+    )
+    parser.add_argument("--repeat", default=3, type=int, help="number of runs")
+    parser.add_argument(
+        "--max-loop-size",
+        default=256,
+        type=int,
+        help="largest size timed with the pixel loop assembly",
+    )
+
+    args = parser.parse_args()
+
+    return args
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    main(args)
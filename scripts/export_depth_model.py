@@ -0,0 +1,70 @@
+# Copyright (C) 2019-2022, Pyronear.
+
+# This program is licensed under the Apache License version 2.
+# See LICENSE or go to <https://www.apache.org/licenses/LICENSE-2.0.txt> for full license details.
+
+from syntheticdataset.randomization.depth_estimation import (
+    MIDAS_HYBRID,
+    MIDAS_LARGE,
+    MIDAS_SMALL,
+    export_model,
+)
+
+
+def main(args):
+
+    config = export_model(
+        args.output,
+        args.model_type,
+        input_shape=tuple(args.input_shape),
+        quantize=args.quantize,
+        hub_dir=args.hub_dir,
+        checkpoint=args.checkpoint,
+    )
+    print(f"Exported {config} to {args.output}")
+
+
+def parse_args():
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description="Export a MiDaS model to TorchScript or ONNX for CPU inference",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+
+    parser.add_argument(
+        "output", help="exported model, .pt for TorchScript or .onnx for ONNX"
+    )
+    parser.add_argument(
+        "--model-type",
+        default=MIDAS_SMALL,
+        choices=[MIDAS_SMALL, MIDAS_HYBRID, MIDAS_LARGE],
+        help="MiDaS model",
+    )
+    parser.add_argument(
+        "--input-shape",
+        nargs=2,
+        default=[256, 448],
+        type=int,
+        help="height and width of the network input, multiples of 32",
+    )
+    parser.add_argument(
+        "--quantize", action="store_true", help="dynamic int8 quantization"
+    )
+    parser.add_argument(
+        "--hub-dir",
+        default=None,
+        help="local clone of intel-isl/MiDaS to load the model offline",
+    )
+    parser.add_argument(
+        "--checkpoint", default=None, help="state dict of the model, for --hub-dir"
+    )
+
+    args = parser.parse_args()
+
+    return args
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    main(args)
@@ -4,9 +4,26 @@
 # See LICENSE or go to <https://www.apache.org/licenses/LICENSE-2.0.txt> for full license details.
 
 import glob
-from syntheticdataset.make_set import make_one_set
+import os
 import random
-from tqdm import tqdm
+from syntheticdataset.journal import Journal, journal_path
+from syntheticdataset.manifest import merge_manifest
+from syntheticdataset.runner import (
+    assign_shard,
+    plan_all_sets,
+    plan_random_sets,
+    run_sets,
+)
+from syntheticdataset.writer import write_shard_index
+
+
+def print_cache_summary(stats):
+    for name, counters in stats.items():
+        print(
+            f"{name} cache: {counters['hit_rate']:.1%} hit rate "
+            f"({counters['hits']} hits, {counters['misses']} misses), "
+            f"{counters['nbytes'] / 1024**2:.1f} MB held"
+        )
 
 
 def main(args):
@@ -19,61 +36,85 @@ def main(args):
             "Smoke or background videos are missing to create the dataset. Please read the documentation."
         )
 
+    root = "pyro_dataset"
+    path = journal_path(root, args.num_shards, args.shard_index)
+    if args.restart and os.path.isfile(path):
+        os.remove(path)
+    # completed sets of previous runs and of the other shards are skipped
+    journal = Journal(path, others=glob.glob(f"{root}/journal*.jsonl"))
+
+    seed = args.seed
+    if seed is None and journal.seed is None and args.num_shards > 1:
+        raise Exception("Shards of a run need a common --seed")
+    if seed is None:
+        seed = journal.seed if journal.seed is not None else random.randrange(2**32)
+    if not args.merge:
+        journal.start(seed)
+    print(f"Seed: {seed}")
+
     if args.set > 0:
         # Make n set
-        set_idx = 0
-        cut_val = int(args.set * 0.8)
-        for i in tqdm(range(args.set)):
-            smoke_video_file = random.sample(smoke_videos, 1)[0]
-            background_file = random.sample(background_videos, 1)[0]
-            fx = random.randint(1, 9) / 10  # random in [0.1, 0.9]
-            fy = random.randint(1, 9) / 10  # random in [0.1, 0.9]
-            opacity = random.randint(4, 10) / 10  # random in [0.4, 1.0]
-            smoke_speed = random.randint(3, 10)  # random in [3, 10]
-
-            make_one_set(
-                smoke_video_file,
-                background_file,
-                root="pyro_dataset",
-                set_idx=set_idx,
-                fx=fx,
-                fy=fy,
-                opacity=opacity,
-                smoke_speed=smoke_speed,
-                train=i < cut_val,
-                save_mask=args.save_mask,
-                save_bbox=args.save_bbox,
+        plan = plan_random_sets(smoke_videos, background_videos, args.set, seed)
+    else:
+        # Make All, sets keep their index, only the new pairs of videos are added
+        plan = plan_all_sets(
+            smoke_videos, background_videos, seed, planned=journal.plan.values()
+        )
+        if not args.merge:
+            journal.record_plan(plan)
+
+    if args.merge:
+        missing = journal.pending(plan)
+        if missing:
+            raise Exception(
+                f"{len(missing)} sets are not made yet: "
+                f"{[task['set_idx'] for task in missing]}"
             )
+    else:
+        plan = journal.pending(assign_shard(plan, args.num_shards, args.shard_index))
+        print(f"{len(journal.done)} sets already made, {len(plan)} to make")
 
-            set_idx += 1
+        common = dict(
+            root=root,
+            save_mask=args.save_mask,
+            save_bbox=args.save_bbox,
+            poisson_options={
+                "solver": args.poisson_solver,
+                "levels": args.poisson_levels,
+            },
+            random_bg_start=args.random_bg_start,
+            frame_store=args.frame_store,
+            image_format=args.image_format,
+            image_level=args.image_level,
+            shard_size=args.shard_size,
+            sky_cache=args.sky_cache,
+            sky_model_type=args.sky_model_type,
+            exclusion_zones=args.exclusion_zone or (),
+            min_valid_fraction=args.min_valid_fraction,
+            chunk_size=args.chunk_size,
+        )
+        stats = run_sets(
+            [dict(task, **common) for task in plan],
+            workers=args.workers,
+            frame_cache_bytes=args.frame_cache_mb * 1024**2,
+            write_workers=args.write_workers,
+            journal=journal,
+            factorization_cache_bytes=args.factorization_cache_mb * 1024**2,
+        )
 
-    else:
-        # Make All
-
-        set_idx = 0
-        cut_val = int(len(background_videos) * 0.8)
-        for smoke_video_file in tqdm(smoke_videos):
-            for i, background_file in enumerate(background_videos):
-                fx = random.randint(1, 9) / 10  # random in [0.1, 0.9]
-                fy = random.randint(1, 9) / 10  # random in [0.1, 0.9]
-                opacity = random.randint(4, 10) / 10  # random in [0.4, 1.0]
-                smoke_speed = random.randint(3, 10)  # random in [3, 10]
-
-                make_one_set(
-                    smoke_video_file,
-                    background_file,
-                    root="pyro_dataset",
-                    set_idx=set_idx,
-                    fx=fx,
-                    fy=fy,
-                    opacity=opacity,
-                    smoke_speed=smoke_speed,
-                    train=i < cut_val,
-                    save_mask=args.save_mask,
-                    save_bbox=args.save_bbox,
-                )
-
-                set_idx += 1
+        print_cache_summary(stats)
+
+        if args.num_shards > 1:
+            print("Run with --merge once every shard is made")
+            return
+
+    # the manifests and shard indexes cover the sets of every shard
+    n_records = merge_manifest(root)
+    print(f"{n_records} samples indexed in {root}/manifest.jsonl")
+
+    if args.shard_size > 0:
+        for folder_path in glob.glob(f"{root}/shards/*/"):
+            write_shard_index(folder_path)
 
 
 def parse_args():
@@ -87,6 +128,127 @@ def parse_args():
     parser.add_argument("--set", default=0, type=int, help="number of set to create")
     parser.add_argument("--save-mask", action="store_true", help="save mask label")
     parser.add_argument("--save-bbox", action="store_true", help="save bbox label")
+    parser.add_argument(
+        "--poisson-solver",
+        default="direct",
+        choices=["direct", "cg", "multigrid"],
+        help="poisson blending solver, iterative ones are warm started",
+    )
+    parser.add_argument(
+        "--poisson-levels",
+        default=0,
+        type=int,
+        help="pyramid levels of the approximate poisson blending, 0 for exact",
+    )
+    parser.add_argument(
+        "--random-bg-start",
+        action="store_true",
+        help="blend the smoke on a random window of the background videos",
+    )
+    parser.add_argument(
+        "--frame-cache-mb",
+        default=1024,
+        type=int,
+        help="memory budget of the decoded smoke frame cache, split between the "
+        "worker processes",
+    )
+    parser.add_argument(
+        "--factorization-cache-mb",
+        default=256,
+        type=int,
+        help="memory budget of the poisson factorization cache, split between the "
+        "worker processes",
+    )
+    parser.add_argument(
+        "--frame-store",
+        default=None,
+        help="frame store folder made by scripts/make_frame_store.py",
+    )
+    parser.add_argument(
+        "--sky-cache",
+        default=None,
+        help="sky mask cache made by scripts/precompute_sky_masks.py, smoke is "
+        "placed on the ground",
+    )
+    parser.add_argument(
+        "--sky-model-type",
+        default="DPT_Large",
+        choices=["DPT_Large", "DPT_Hybrid", "MiDaS_small"],
+        help="depth model of the cached sky masks",
+    )
+    parser.add_argument(
+        "--exclusion-zone",
+        nargs=4,
+        type=float,
+        action="append",
+        metavar=("Y0", "X0", "Y1", "X1"),
+        help="box of the backgrounds where smoke is not placed, as fractions of "
+        "their height and width, can be repeated",
+    )
+    parser.add_argument(
+        "--min-valid-fraction",
+        default=0.25,
+        type=float,
+        help="minimum fraction of the smoke box on the ground and outside of the "
+        "exclusion zones",
+    )
+    parser.add_argument(
+        "--chunk-size", default=8, type=int, help="frames of a set blended at once"
+    )
+    parser.add_argument(
+        "--workers", default=1, type=int, help="number of worker processes"
+    )
+    parser.add_argument(
+        "--write-workers",
+        default=4,
+        type=int,
+        help="number of image writer threads of each worker process, 0 to write inline",
+    )
+    parser.add_argument(
+        "--image-format",
+        default="png",
+        choices=["png", "jpg", "webp"],
+        help="image format of the blended frames",
+    )
+    parser.add_argument(
+        "--image-level",
+        default=None,
+        type=int,
+        help="PNG compression level (0-9) or JPEG/WebP quality (0-100)",
+    )
+    parser.add_argument(
+        "--shard-size",
+        default=0,
+        type=int,
+        help="maximum samples per tar shard under pyro_dataset/shards, each set has "
+        "its own shards, 0 for one file per image",
+    )
+    parser.add_argument(
+        "--seed",
+        default=None,
+        type=int,
+        help="seed of the run, sets are identical for any number of workers, "
+        "defaults to the seed of the resumed run",
+    )
+    parser.add_argument(
+        "--num-shards",
+        default=1,
+        type=int,
+        help="number of nodes sharing the run, with a common --seed",
+    )
+    parser.add_argument(
+        "--shard-index", default=0, type=int, help="index of the node in the run"
+    )
+    parser.add_argument(
+        "--merge",
+        action="store_true",
+        help="check that every shard is made and merge their manifests",
+    )
+    parser.add_argument(
+        "--restart",
+        action="store_true",
+        help="forget the completed sets of previous runs instead of resuming",
+    )
 
     args = parser.parse_args()
 
@@ -0,0 +1,49 @@
+# Copyright (C) 2019-2022, Pyronear.
+
+# This program is licensed under the Apache License version 2.
+# See LICENSE or go to <https://www.apache.org/licenses/LICENSE-2.0.txt> for full license details.
+
+import glob
+from syntheticdataset.frame_store import open_store
+from syntheticdataset.utils import export_video
+from tqdm import tqdm
+
+
+def main(args):
+
+    videos = sorted(glob.glob("videos/smoke/*")) + sorted(
+        glob.glob("videos/background/*")
+    )
+
+    if not videos:
+        raise Exception("Videos are missing. Please read the documentation.")
+
+    for file in tqdm(videos):
+        if args.force or open_store(args.store, file, args.size_max) is None:
+            export_video(file, args.store, size_max=args.size_max)
+
+
+def parse_args():
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description="Decode smoke and background videos into a memory mapped frame store",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+
+    parser.add_argument("--store", default="frame_store", help="frame store folder")
+    parser.add_argument(
+        "--size-max", default=1280, type=int, help="largest side of the stored frames"
+    )
+    parser.add_argument(
+        "--force", action="store_true", help="export videos already in the store"
+    )
+
+    args = parser.parse_args()
+
+    return args
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    main(args)
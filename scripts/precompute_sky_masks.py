@@ -0,0 +1,149 @@
+# Copyright (C) 2019-2022, Pyronear.
+
+# This program is licensed under the Apache License version 2.
+# See LICENSE or go to <https://www.apache.org/licenses/LICENSE-2.0.txt> for full license details.
+
+import cv2
+import glob
+import os
+from syntheticdataset.randomization.depth_estimation import DepthEstimation
+from syntheticdataset.sky_cache import sky_cache_path, write_sky_masks
+from syntheticdataset.utils import iter_video
+from tqdm import tqdm
+
+
+def main(args):
+
+    background_videos = sorted(glob.glob("videos/background/*"))
+
+    if not background_videos:
+        raise Exception("Background videos are missing. Please read the documentation.")
+
+    videos = [
+        file
+        for file in background_videos
+        if args.force
+        or not os.path.isfile(
+            sky_cache_path(args.cache, file, args.model_type, args.size_max)
+        )
+    ]
+    if not videos:
+        return
+
+    depth = DepthEstimation(
+        args.model_type,
+        num_threads=args.threads,
+        input_size=args.input_size,
+        hub_dir=args.hub_dir,
+        checkpoint=args.checkpoint,
+        model_path=args.model_path,
+    )
+
+    for file in tqdm(videos):
+        frames = [
+            cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+            for frame in iter_video(file, size_max=args.size_max, stride=args.stride)
+        ]
+        if args.keyframe_threshold is not None:
+            # the model only runs on frames where the scene changed
+            masks = depth.detect_sky_from_sequence(
+                frames,
+                threshold=args.keyframe_threshold,
+                max_interval=args.max_interval,
+                batch_size=args.batch_size,
+            )
+        else:
+            masks = depth.detect_sky_from_frames(frames, batch_size=args.batch_size)
+
+        write_sky_masks(
+            args.cache,
+            file,
+            args.model_type,
+            args.size_max,
+            {i * args.stride: mask for i, mask in enumerate(masks)},
+        )
+
+    stats = depth.stats()
+    print(
+        f"{stats['frames']} frames estimated, {stats['saved']} reused, "
+        f"{stats['frames_per_s']:.1f} frames/s, {stats['ms_per_batch']:.0f} ms per batch"
+    )
+
+
+def parse_args():
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description="Estimate the sky masks of the background videos",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+
+    parser.add_argument("--cache", default="sky_cache", help="sky mask cache folder")
+    parser.add_argument(
+        "--model-type",
+        default="DPT_Large",
+        choices=["DPT_Large", "DPT_Hybrid", "MiDaS_small"],
+        help="MiDaS depth model",
+    )
+    parser.add_argument(
+        "--size-max",
+        default=1280,
+        type=int,
+        help="largest side of the frames, as the backgrounds of make_dataset.py",
+    )
+    parser.add_argument(
+        "--stride",
+        default=25,
+        type=int,
+        help="frames between two masks, cameras are static",
+    )
+    parser.add_argument(
+        "--keyframe-threshold",
+        default=None,
+        type=float,
+        help="mean absolute difference of the frames triggering a new depth "
+        "estimation, every frame is estimated if None",
+    )
+    parser.add_argument(
+        "--max-interval",
+        default=25,
+        type=int,
+        help="maximum number of masks between two depth estimations",
+    )
+    parser.add_argument(
+        "--batch-size", default=8, type=int, help="frames per forward pass"
+    )
+    parser.add_argument(
+        "--threads", default=None, type=int, help="number of CPU threads of torch"
+    )
+    parser.add_argument(
+        "--input-size",
+        default=None,
+        type=int,
+        help="height of the network input, multiple of 32",
+    )
+    parser.add_argument(
+        "--hub-dir",
+        default=None,
+        help="local clone of intel-isl/MiDaS to load the model offline",
+    )
+    parser.add_argument(
+        "--checkpoint", default=None, help="state dict of the model, for --hub-dir"
+    )
+    parser.add_argument(
+        "--model-path",
+        default=None,
+        help="TorchScript or ONNX model exported for --model-type",
+    )
+    parser.add_argument(
+        "--force", action="store_true", help="estimate videos already in the cache"
+    )
+
+    args = parser.parse_args()
+
+    return args
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    main(args)
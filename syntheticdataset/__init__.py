@@ -3,8 +3,13 @@
 # This program is licensed under the Apache License version 2.
 # See LICENSE or go to <https://www.apache.org/licenses/LICENSE-2.0.txt> for full license details.
 
+from .cache import *
 from .image_blending import *
 from .make_set import *
+from .manifest import *
+from .placement import *
 from .poisson_blending_utils import *
+from .sky_cache import *
 from .utils import *
+from .writer import *
 from .version import __version__
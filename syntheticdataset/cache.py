@@ -0,0 +1,83 @@
+# Copyright (C) 2019-2022, Pyronear.
+
+# This program is licensed under the Apache License version 2.
+# See LICENSE or go to <https://www.apache.org/licenses/LICENSE-2.0.txt> for full license details.
+
+from collections import OrderedDict
+
+
+class LRUCache:
+    """Least recently used cache bounded by the memory held by its values
+
+    Args:
+        max_bytes (int): memory budget of the cache, 0 disables it
+        sizeof (callable): returns the size in bytes of a value
+    """
+
+    def __init__(self, max_bytes, sizeof):
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof
+        self._data = OrderedDict()
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key, default=None):
+        """Return the value stored for key and mark it as recently used"""
+        if key in self._data:
+            self.hits += 1
+            self._data.move_to_end(key)
+            return self._data[key][0]
+
+        self.misses += 1
+        return default
+
+    def put(self, key, value):
+        """Store value, evicting the least recently used entries to fit the budget
+
+        Returns:
+            bool: whether value was stored (values larger than the budget are not)
+        """
+        nbytes = self.sizeof(value)
+        self.pop(key)
+        if nbytes > self.max_bytes:
+            return False
+
+        while self.nbytes + nbytes > self.max_bytes:
+            _, (_, evicted) = self._data.popitem(last=False)
+            self.nbytes -= evicted
+
+        self._data[key] = (value, nbytes)
+        self.nbytes += nbytes
+
+        return True
+
+    def pop(self, key):
+        if key in self._data:
+            value, nbytes = self._data.pop(key)
+            self.nbytes -= nbytes
+            return value
+
+    def clear(self):
+        self._data.clear()
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def stats(self):
+        """Return the cache counters as a dict"""
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "entries": len(self._data),
+            "nbytes": self.nbytes,
+            "max_bytes": self.max_bytes,
+        }
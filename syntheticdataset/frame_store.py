@@ -0,0 +1,88 @@
+# Copyright (C) 2019-2022, Pyronear.
+
+# This program is licensed under the Apache License version 2.
+# See LICENSE or go to <https://www.apache.org/licenses/LICENSE-2.0.txt> for full license details.
+
+import json
+import os
+import numpy as np
+
+
+def store_path(store_dir, file, size_max):
+    """Path of the stored frames of a video without extension
+
+    The store mirrors the parent folder of the videos, e.g.
+    videos/smoke/a.mp4 -> store_dir/smoke/a.mp4.1280
+    """
+    parent = os.path.basename(os.path.dirname(os.path.abspath(file)))
+    return os.path.join(store_dir, parent, f"{os.path.basename(file)}.{size_max}")
+
+
+def write_store(store_dir, file, size_max, frames):
+    """Write frames as a raw uint8 array next to a small JSON header
+
+    Args:
+        store_dir (str): root folder of the store
+        file (str): source video file
+        size_max (int): size of the largest side of the frames
+        frames (iterable): resized frames of the video
+
+    Returns:
+        dict: header of the stored video
+    """
+
+    path = store_path(store_dir, file, size_max)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    shape = None
+    n_frames = 0
+    with open(path + ".raw.tmp", "wb") as f:
+        for frame in frames:
+            shape = frame.shape
+            f.write(np.ascontiguousarray(frame, dtype=np.uint8).tobytes())
+            n_frames += 1
+
+    st = os.stat(file)
+    header = {
+        "source": os.path.abspath(file),
+        "mtime_ns": st.st_mtime_ns,
+        "size": st.st_size,
+        "size_max": size_max,
+        "shape": [n_frames] + list(shape or (0, 0, 3)),
+        "dtype": "uint8",
+    }
+    with open(path + ".json.tmp", "w") as f:
+        json.dump(header, f)
+
+    # the header is written last, a video is only stored once it exists
+    os.replace(path + ".raw.tmp", path + ".raw")
+    os.replace(path + ".json.tmp", path + ".json")
+
+    return header
+
+
+def open_store(store_dir, file, size_max):
+    """Memory map the stored frames of a video
+
+    Returns:
+        np.memmap: read-only frames of shape (n, h, w, 3), None when the video
+        is not stored or changed since it was
+    """
+
+    path = store_path(store_dir, file, size_max)
+    if not os.path.isfile(path + ".json"):
+        return None
+
+    with open(path + ".json") as f:
+        header = json.load(f)
+
+    st = os.stat(file)
+    if header["mtime_ns"] != st.st_mtime_ns or header["size"] != st.st_size:
+        return None
+
+    if header["shape"][0] == 0:
+        return np.zeros(header["shape"], dtype=header["dtype"])
+
+    return np.memmap(
+        path + ".raw", dtype=header["dtype"], mode="r", shape=tuple(header["shape"])
+    )
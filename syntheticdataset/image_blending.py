@@ -5,10 +5,95 @@
 
 import cv2
 import numpy as np
-from syntheticdataset.poisson_blending_utils import create_mask, poisson_blend
+import threading
+from syntheticdataset.poisson_blending_utils import (
+    create_mask,
+    poisson_blend,
+    poisson_blend_pyramid,
+)
+from syntheticdataset.utils import get_bboxes
 
 
-def basic_blending(img, smoke, offset=(0, 0), opacity=0.8):
+class BasicBlender:
+    """Basic image blending on float32 scratch buffers reused across frames of
+    the same smoke size, the blended ROI is written in place
+
+    Args:
+        ks (int, optional): size of the box filter smoothing the smoke. Defaults to 7.
+    """
+
+    def __init__(self, ks=7):
+        self.ks = ks
+        self._buffers = {}
+
+    def _scratch(self, shape):
+        if shape not in self._buffers:
+            # a set has a single smoke size, buffers of other sizes are dropped
+            self._buffers = {
+                shape: (
+                    np.empty(shape + (3,), np.uint8),
+                    np.empty(shape + (3,), np.float32),
+                    np.empty(shape + (3,), np.float32),
+                    np.empty(shape, bool),
+                )
+            }
+        return self._buffers[shape]
+
+    def blend(self, img, smoke, offset=(0, 0), opacity=0.8):
+        """Add smoke on image in place
+
+        Args:
+            img (np.array): background image
+            smoke (np.array): smoke image
+            offset (tuple, optional): smoke location offset (dy, dx). Defaults to (0, 0).
+            opacity (float, optional): smoke image opacity in [0, 1]. Defaults to 0.8.
+
+        Returns:
+            np.array: result image
+            np.array: result mask of the smoke ROI, overwritten by the next blend
+        """
+
+        h, w = smoke.shape[:2]
+        dy, dx = offset
+        dst, weight, tmp, mask = self._scratch((h, w))
+
+        cv2.blur(smoke, (self.ks, self.ks), dst=dst)
+        np.greater(dst[:, :, 0], 50, out=mask)
+
+        # weight of the smoke, 1 - alpha
+        dst_max = dst.max()
+        np.multiply(dst, np.float32(opacity / dst_max if dst_max else 0), out=weight)
+
+        # temp * alpha + smoke * (1 - alpha) = temp + (smoke - temp) * (1 - alpha)
+        roi = img[dy : dy + h, dx : dx + w, :]
+        np.subtract(smoke[:, :, ::-1], roi, out=tmp, dtype=np.float32)
+        tmp *= weight
+        tmp += roi
+        np.copyto(roi, tmp, casting="unsafe")
+
+        return img, mask
+
+
+# Blenders of basic_blending, their buffers are reused across the calls of a
+# thread
+_BLENDERS = threading.local()
+
+
+def _basic_blender():
+    if not hasattr(_BLENDERS, "blender"):
+        _BLENDERS.blender = BasicBlender()
+    return _BLENDERS.blender
+
+
+def full_mask(mask, offset, shape):
+    """Full frame mask of a ROI mask at offset"""
+    dy, dx = offset
+    res = np.zeros(shape, dtype=np.uint8)
+    res[dy : dy + mask.shape[0], dx : dx + mask.shape[1]] = mask
+    return res
+
+
+def basic_blending(img, smoke, offset=(0, 0), opacity=0.8, roi_mask=False):
     """Add smoke on image using basic image blending
 
     Args:
@@ -16,12 +101,24 @@ def basic_blending(img, smoke, offset=(0, 0), opacity=0.8):
         smoke (np.array): smoke image
         offset (tuple, optional): smoke location offset (dy, dx). Defaults to (0, 0).
         opacity (float, optional): smoke image opacity in [0, 1]. Defaults to (0, 0).
+        roi_mask (bool, optional): return the mask of the smoke ROI, at offset,
+            instead of the full frame one. Defaults to False.
 
     Returns:
         np.array: result image
         np.array: result mask
     """
 
+    img, mask = _basic_blender().blend(img, smoke, offset, opacity)
+    if roi_mask:
+        return img, mask.copy()
+
+    return img, full_mask(mask, offset, img.shape[:2])
+
+
+def _basic_blending_reference(img, smoke, offset=(0, 0), opacity=0.8):
+    """Former float64 implementation of basic_blending, kept as a reference"""
+
     ks = 7
     kernel = np.ones((ks, ks), np.float32) / (ks**2)
 
@@ -33,33 +130,192 @@ def basic_blending(img, smoke, offset=(0, 0), opacity=0.8):
     res = temp * alpha + smoke[:, :, ::-1] * (1 - alpha)
     img[dy : dy + smoke.shape[0], dx : dx + smoke.shape[1], :] = res
     mask = img[:, :, 0] * 0
-    mask[dy : dy + smoke.shape[0], dx : dx+ smoke.shape[1]] = mask_dst
+    mask[dy : dy + smoke.shape[0], dx : dx + smoke.shape[1]] = mask_dst
 
     return img, mask
 
 
-def poisson_blending(img, smoke, offset=(0, 0)):
+def poisson_blending(
+    img,
+    smoke,
+    offset=(0, 0),
+    method="normal",
+    solver="direct",
+    x0=None,
+    tol=1e-3,
+    maxiter=None,
+    levels=0,
+    refine_iters=10,
+    roi_mask=False,
+):
     """Add smoke on image using poisson image blending
 
     Args:
         img (np.array): background image
         smoke (np.array): smoke image
         offset (tuple, optional): smoke location offset (dy, dx). Defaults to (0, 0).
+        method (str, optional): "normal", "mix" or "fast" to solve the whole smoke
+            rectangle with a discrete sine transform. Defaults to "normal".
+        solver (str, optional): "direct", "cg" or "multigrid". Defaults to "direct".
+        x0 (np.array, optional): initial guess of the iterative solvers, e.g. the
+            result of the previous frame. Defaults to None.
+        tol (float, optional): relative residual of the iterative solvers.
+            Defaults to 1e-3.
+        maxiter (int, optional): maximum iterations of the iterative solvers.
+            Defaults to None.
+        levels (int, optional): number of pyramid levels, the blend is solved at a
+            resolution divided by 2 ** levels then refined. Defaults to 0.
+        refine_iters (int, optional): refinement iterations at full resolution of
+            the pyramid mode. Defaults to 10.
+        roi_mask (bool, optional): return the mask of the smoke ROI, at offset,
+            instead of the full frame one. Defaults to False.
 
     Returns:
         np.array: result image
         np.array: result mask
     """
 
+    roi_shape = smoke.shape[:2]
     smoke_mask = smoke[:, :, 0] > 50
     smoke_mask, smoke, offset_adj = create_mask(smoke_mask, img, smoke, offset=offset)
 
-    result = poisson_blend(
-        smoke_mask, smoke, img, method="normal", offset_adj=offset_adj
+    # blend on the region under the smoke only, its border is the boundary
+    hm, wm = smoke_mask.shape
+    roi = (
+        slice(offset_adj[0], offset_adj[0] + hm),
+        slice(offset_adj[1], offset_adj[1] + wm),
     )
+    if x0 is not None:
+        x0 = x0[roi]
 
-    mask = img[:, :, 0] * 0
+    if levels > 0:
+        result = poisson_blend_pyramid(
+            smoke_mask,
+            smoke,
+            img[roi],
+            method=method,
+            levels=levels,
+            refine_iters=refine_iters,
+        )
+    else:
+        result = poisson_blend(
+            smoke_mask,
+            smoke,
+            img[roi],
+            method=method,
+            domain="mask",
+            solver=solver,
+            x0=x0,
+            tol=tol,
+            maxiter=maxiter,
+        )
+    img[roi] = result
+
+    mask = np.zeros(roi_shape, dtype=np.uint8)
+    mask[:hm, :wm] = smoke_mask
+    if roi_mask:
+        return img, mask
+
+    return img, full_mask(mask, offset, img.shape[:2])
+
+
+def _basic_blend_chunk(imgs, smokes, offset, opacity, ks, buffers):
+    """Basic blending of stacked frames in place, as BasicBlender.blend"""
+
+    n, h, w = smokes.shape[:3]
+    dy, dx = offset
+    dst, rgb, weight, tmp = (buffer[:n] for buffer in buffers)
+
+    # OpenCV filters a frame at a time, the other steps run on the whole chunk
+    for smoke, out, out_rgb in zip(smokes, dst, rgb):
+        cv2.blur(smoke, (ks, ks), dst=out)
+        cv2.cvtColor(smoke, cv2.COLOR_BGR2RGB, dst=out_rgb)
+    masks = dst[..., 0] > 50
+
+    # weight of the smoke, 1 - alpha
+    dst_max = dst.max(axis=(1, 2, 3)).astype(float)
+    scale = np.divide(opacity, dst_max, out=np.zeros_like(dst_max), where=dst_max > 0)
+    np.multiply(dst, scale[:, None, None, None].astype(np.float32), out=weight)
+
+    # a contiguous float32 ROI keeps the subtraction on the fast path
+    roi = imgs[:, dy : dy + h, dx : dx + w, :]
+    np.copyto(tmp, roi)
+    np.subtract(rgb, tmp, out=tmp)
+    tmp *= weight
+    tmp += roi
+    np.copyto(roi, tmp, casting="unsafe")
+
+    return masks
+
+
+def blend_clip(
+    bg_frames,
+    smoke_frames,
+    offset=(0, 0),
+    opacity=0.8,
+    method="basic",
+    chunk_size=8,
+    roi_mask=False,
+    ks=7,
+    x0=None,
+    poisson_options=None,
+):
+    """Add the smoke frames of a clip on its background frames, basic blending
+    runs on chunks of stacked frames, poisson blending frame by frame with the
+    previous result as initial guess
+
+    Args:
+        bg_frames (np.array): background frames of shape (N, H, W, 3), not modified
+        smoke_frames (np.array): smoke frames of shape (N, h, w, 3)
+        offset (tuple, optional): smoke location offset (dy, dx). Defaults to (0, 0).
+        opacity (float, optional): smoke image opacity in [0, 1], basic blending
+            only. Defaults to 0.8.
+        method (str, optional): "basic" or "poisson". Defaults to "basic".
+        chunk_size (int, optional): frames blended at once. Defaults to 8.
+        roi_mask (bool, optional): return the masks of the smoke ROI, at offset,
+            instead of the full frame ones. Defaults to False.
+        ks (int, optional): size of the box filter of basic blending. Defaults to 7.
+        x0 (np.array, optional): initial guess of the first poisson frame, e.g. the
+            last result of the previous clip. Defaults to None.
+        poisson_options (dict, optional): options of poisson_blending.
+            Defaults to None.
+
+    Returns:
+        np.array: result frames of shape (N, H, W, 3)
+        np.array: result masks of shape (N, H, W), (N, h, w) with roi_mask
+        np.array: boxes (xc, yc, w, h) relative to the frames, of shape (N, 4), NaN
+            for smoke below the minimum size
+    """
+
+    smoke_frames = np.asarray(smoke_frames)
+    results = np.array(bg_frames, dtype=np.uint8)
+    n, h, w = smoke_frames.shape[:3]
     dy, dx = offset
-    mask[dy : dy + smoke_mask.shape[0], dx : dx + smoke_mask.shape[1]] = smoke_mask
 
-    return result, mask
+    masks = np.empty((n, h, w), dtype=np.uint8)
+    if method == "basic":
+        shape = (min(chunk_size, n), h, w, 3)
+        # blurred and RGB smoke, weight and blended ROI, reused across chunks
+        buffers = [np.empty(shape, dtype) for dtype in ("u1", "u1", "f4", "f4")]
+        for start in range(0, n, chunk_size):
+            chunk = slice(start, start + chunk_size)
+            masks[chunk] = _basic_blend_chunk(
+                results[chunk], smoke_frames[chunk], offset, opacity, ks, buffers
+            )
+    elif method == "poisson":
+        poisson_options = poisson_options or {}
+        for img, smoke, mask in zip(results, smoke_frames, masks):
+            _, mask[:] = poisson_blending(
+                img, smoke, offset, x0=x0, roi_mask=True, **poisson_options
+            )
+            x0 = img
+    else:
+        raise ValueError(f"Unknown blending method {method}")
+
+    bboxes = get_bboxes(masks, offset, results.shape[1:3])
+    if not roi_mask:
+        full = np.zeros(results.shape[:3], dtype=np.uint8)
+        full[:, dy : dy + h, dx : dx + w] = masks
+        masks = full
+
+    return results, masks, bboxes
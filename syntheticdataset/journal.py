@@ -0,0 +1,133 @@
+# Copyright (C) 2019-2022, Pyronear.
+
+# This program is licensed under the Apache License version 2.
+# See LICENSE or go to <https://www.apache.org/licenses/LICENSE-2.0.txt> for full license details.
+
+import json
+import os
+
+# fields identifying the content of a set
+SET_FIELDS = ("smoke_video_file", "background_file", "seed")
+# fields of a planned set, kept by the next runs
+PLAN_FIELDS = ("smoke_video_file", "background_file", "set_idx", "train")
+
+
+def journal_path(root, num_shards=1, shard_index=0):
+    """Journal of a shard of the runs made in root"""
+    if num_shards == 1:
+        return f"{root}/journal.jsonl"
+    return f"{root}/journal_{shard_index:03}_of_{num_shards:03}.jsonl"
+
+
+class Journal:
+    """Append only JSONL record of the seed of a run, of its planned sets and of
+    its completed sets, a set is recorded once all its files are written
+
+    Args:
+        path (str): JSONL file, loaded when it exists
+        others (list, optional): journals of the other shards of the run, their
+            sets count as planned or completed but are not written.
+            Defaults to ().
+    """
+
+    def __init__(self, path, others=()):
+        self.path = path
+        self.seed = None
+        self.done = {}
+        # planned sets by index, completed ones included
+        self.plan = {}
+
+        self._load(path, repair=True)
+        for other in others:
+            if os.path.abspath(other) != os.path.abspath(path):
+                self._load(other, repair=False)
+
+    def _load(self, path, repair):
+        if not os.path.isfile(path):
+            return
+
+        lines = []
+        with open(path) as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    # last line cut by a crash, drop it before appending
+                    if repair:
+                        with open(path + ".tmp", "w") as tmp:
+                            tmp.writelines(lines)
+                        os.replace(path + ".tmp", path)
+                    break
+                lines.append(line)
+                if "set" in entry:
+                    self.done[entry["set"]["set_idx"]] = entry["set"]
+                    self._plan([entry["set"]])
+                elif "plan" in entry:
+                    self._plan(entry["plan"])
+                elif self.seed is None:
+                    self.seed = entry["seed"]
+                elif self.seed != entry["seed"]:
+                    raise ValueError(
+                        f"{path} was made with another seed than {self.seed}"
+                    )
+
+    def _plan(self, tasks):
+        for task in tasks:
+            planned = {field: task[field] for field in PLAN_FIELDS}
+            # shards started from other videos
+            if self.plan.get(task["set_idx"], planned) != planned:
+                raise ValueError(
+                    f"Set {task['set_idx']} was planned from other videos by "
+                    "another journal, use another dataset folder"
+                )
+            self.plan[task["set_idx"]] = planned
+
+    def _append(self, entry):
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        with open(self.path, "a") as f:
+            f.write(json.dumps(entry) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+    def start(self, seed):
+        """Record the seed of the run, resumed runs must use the same seed"""
+        if self.seed is None:
+            self._append({"seed": seed})
+            self.seed = seed
+        elif self.seed != seed:
+            raise ValueError(f"{self.path} was made with seed {self.seed}, not {seed}")
+
+    def record_plan(self, tasks):
+        """Record the sets of tasks that are not planned yet, their index and
+        split are kept when the run is resumed"""
+        new = [task for task in tasks if task["set_idx"] not in self.plan]
+        if new:
+            self._plan(new)
+            self._append({"plan": [self.plan[task["set_idx"]] for task in new]})
+
+    def add(self, task):
+        """Record a completed set"""
+        self._append({"set": task})
+        self.done[task["set_idx"]] = task
+        self._plan([task])
+
+    def pending(self, tasks):
+        """Sets of tasks that are not completed yet
+
+        Args:
+            tasks (list): make_one_set keyword arguments of every set
+
+        Returns:
+            list: tasks of the sets missing from the journal
+        """
+        pending = []
+        for task in tasks:
+            done = self.done.get(task["set_idx"])
+            if done is None:
+                pending.append(task)
+            elif any(done[field] != task[field] for field in SET_FIELDS):
+                raise ValueError(
+                    f"Set {task['set_idx']} of {self.path} was made from other "
+                    "videos, use another dataset folder"
+                )
+        return pending
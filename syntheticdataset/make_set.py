@@ -5,17 +5,150 @@
 
 import cv2
 import numpy as np
+import os
 import random
-from syntheticdataset.utils import read_video, save_img, save_label, get_label
-from syntheticdataset.image_blending import basic_blending, poisson_blending
+from contextlib import ExitStack
+from itertools import chain, count, islice
+from syntheticdataset.utils import (
+    FRAME_CACHE,
+    bbox_label,
+    get_video_length,
+    video_frames,
+)
+from syntheticdataset.image_blending import blend_clip
+from syntheticdataset.manifest import ManifestWriter, manifest_part
+from syntheticdataset.placement import PLACEMENT_CACHE, Placement, valid_mask
+from syntheticdataset.sky_cache import read_sky_mask, stored_frame
+from syntheticdataset.writer import (
+    AsyncWriter,
+    ShardWriter,
+    encode_params,
+    remove_temp_files,
+)
 
 
+# method of blend_clip of each blending type
 BLENDING_METHODS = {
-    "basic_blending": basic_blending,
-    "poisson_blending": poisson_blending,
+    "basic_blending": "basic",
+    "poisson_blending": "poisson",
 }
 
 
+def iter_smoke(
+    smoke_video_file, fx, fy, smoke_speed, smoke_offset, size_max, cache, store
+):
+    """Lazily read and resize the subsampled smoke frames"""
+    for smoke_img in video_frames(
+        smoke_video_file,
+        size_max=size_max,
+        start=smoke_offset,
+        stride=smoke_speed,
+        cache=cache,
+        store=store,
+    ):
+        yield cv2.resize(smoke_img, (0, 0), fx=fx, fy=fy)
+
+
+def get_placement(
+    background_file,
+    frame_idx,
+    shape,
+    size_max,
+    sky_cache=None,
+    sky_model_type="DPT_Large",
+    exclusion_zones=(),
+    cache=PLACEMENT_CACHE,
+):
+    """Placement of the smoke in a background frame, from its cached sky mask and
+    exclusion zones, None when every position is valid. Placements are shared
+    across sets through cache."""
+
+    if sky_cache is None and not exclusion_zones:
+        return None
+
+    # frames sharing a stored sky mask share their placement
+    mask_idx = None
+    if sky_cache is not None:
+        mask_idx = stored_frame(
+            sky_cache, background_file, frame_idx, sky_model_type, size_max
+        )
+
+    key = (
+        os.path.abspath(background_file),
+        mask_idx,
+        shape,
+        size_max,
+        sky_cache,
+        sky_model_type,
+        tuple(map(tuple, exclusion_zones)),
+    )
+    placement = cache.get(key)
+    if placement is None:
+        # precomputed sky masks, depth is never estimated while making sets
+        ground = None
+        if mask_idx is not None:
+            ground = read_sky_mask(
+                sky_cache, background_file, mask_idx, sky_model_type, size_max
+            )
+            if ground is not None and ground.shape != shape:
+                ground = None
+        placement = Placement(valid_mask(shape, ground, exclusion_zones))
+        cache.put(key, placement)
+
+    return placement
+
+
+def blend_frames(
+    frames, offset, opacity=0.8, chunk_size=8, roi_mask=False, poisson_options=None
+):
+    """Blend smoke on backgrounds with every blending method, by chunks of frames
+
+    Args:
+        frames (iterable): (smoke, background) frames
+        offset (tuple): smoke location offset (dy, dx)
+        opacity (float, optional): smoke opacity of basic blending. Defaults to 0.8.
+        chunk_size (int, optional): frames stacked and blended at once.
+            Defaults to 8.
+        roi_mask (bool, optional): yield the masks of the smoke ROI instead of the
+            full frame ones. Defaults to False.
+        poisson_options (dict, optional): options of poisson_blending.
+            Defaults to None.
+
+    Yields:
+        tuple: frame index, blending type, result image, mask and label
+    """
+
+    frames = iter(frames)
+    # the previous poisson frame is the initial guess of iterative solvers
+    previous = None
+    for start in count(0, chunk_size):
+        chunk = list(islice(frames, chunk_size))
+        if not chunk:
+            return
+        smokes = np.stack([smoke for smoke, _ in chunk])
+        bgs = np.stack([img for _, img in chunk])
+
+        clips = {}
+        for blending_type, method in BLENDING_METHODS.items():
+            clips[blending_type] = blend_clip(
+                bgs,
+                smokes,
+                offset,
+                opacity,
+                method,
+                chunk_size,
+                roi_mask=roi_mask,
+                x0=previous,
+                poisson_options=poisson_options,
+            )
+        previous = clips["poisson_blending"][0][-1]
+
+        for j in range(len(chunk)):
+            for blending_type, (results, masks, bboxes) in clips.items():
+                label = bbox_label(bboxes[j])
+                yield start + j, blending_type, results[j], masks[j], label
+
+
 def make_one_set(
     smoke_video_file,
     background_file,
@@ -31,67 +164,206 @@ def make_one_set(
     save_bbox=False,
     size_max_bg=1280,
     size_max_smoke=1280,
+    poisson_options=None,
+    random_bg_start=False,
+    frame_cache=FRAME_CACHE,
+    frame_store=None,
+    seed=None,
+    writer=None,
+    image_format="png",
+    image_level=None,
+    shard_size=0,
+    manifest=True,
+    sky_cache=None,
+    sky_model_type="DPT_Large",
+    exclusion_zones=(),
+    min_valid_fraction=0.25,
+    chunk_size=8,
 ):
 
-    # Get smokes frames
-    smoke_imgs = read_video(smoke_video_file, size_max=size_max_smoke)
+    poisson_options = poisson_options or {}
+    rng = random if seed is None else random.Random(seed)
+
+    smoke_args = (
+        smoke_video_file,
+        fx,
+        fy,
+        smoke_speed,
+        smoke_offset,
+        size_max_smoke,
+        frame_cache,
+        frame_store,
+    )
 
-    # Resize smokes frames
-    smoke_imgs = [
-        cv2.resize(smoke_img, (0, 0), fx=fx, fy=fy)
-        for smoke_img in smoke_imgs[smoke_offset::smoke_speed]
-    ]
-    # Compute mask
-    smoke_mask = 0 * smoke_imgs[0]
-    for smoke_img in smoke_imgs:
-        smoke_mask[smoke_img > 50] = 255
+    # Compute mask, frames are streamed twice to keep a few of them in memory:
+    # the second pass is read from the frame cache or the frame store when they
+    # are enabled, otherwise the smoke clip is decoded twice
+    smoke_mask = None
+    n_frames = 0
+    for smoke_img in iter_smoke(*smoke_args):
+        if smoke_mask is None:
+            smoke_mask = np.zeros(smoke_img.shape[:2], dtype=bool)
+        smoke_mask |= smoke_img[:, :, 0] > 50
+        n_frames += 1
 
-    y, x = np.where(smoke_mask[:, :, 0] == 255)
+    y, x = np.where(smoke_mask)
     x0 = min(x)
     x1 = max(x)
     y0 = min(y)
     y1 = max(y)
 
     # Apply mask
-    smoke_imgs = [smoke_img[y0:y1, x0:x1, :] for smoke_img in smoke_imgs]
+    smoke_imgs = (smoke_img[y0:y1, x0:x1, :] for smoke_img in iter_smoke(*smoke_args))
 
-    # Read background
-    imgs = read_video(background_file, size_max=size_max_bg)
+    # Read background, only the frames that will be blended are decoded. Windows
+    # of the background videos are rarely blended twice, they are not cached to
+    # keep the frame cache for the smoke clips
+    bg_start = 0
+    if random_bg_start:
+        bg_start = rng.randint(0, max(get_video_length(background_file) - n_frames, 0))
+    imgs = video_frames(
+        background_file,
+        size_max=size_max_bg,
+        start=bg_start,
+        max_frames=n_frames,
+        cache=None,
+        store=frame_store,
+    )
+    first = next(imgs, None)
+    if first is None:
+        # the container frame count can be larger than the decodable frames
+        bg_start = 0
+        imgs = video_frames(
+            background_file,
+            size_max=size_max_bg,
+            max_frames=n_frames,
+            cache=None,
+            store=frame_store,
+        )
+        first = next(imgs)
+    imgs = chain([first], imgs)
 
     name = "set_" + str(set_idx).zfill(3) + "_"
 
     # Random offset
-    hs, ws = smoke_imgs[0].shape[:2]
-    hbg, wbg = imgs[0].shape[:2]
+    hs, ws = y1 - y0, x1 - x0
+    hbg, wbg = first.shape[:2]
 
     if hs < hbg and ws < wbg:
-        dy = random.randint(0, hbg - hs - 1)
-        dx = random.randint(0, wbg - ws - 1)
+        placement = get_placement(
+            background_file,
+            bg_start,
+            (hbg, wbg),
+            size_max_bg,
+            sky_cache,
+            sky_model_type,
+            exclusion_zones,
+        )
+        if placement is None:
+            dy = rng.randint(0, hbg - hs - 1)
+            dx = rng.randint(0, wbg - ws - 1)
+        else:
+            dy, dx = placement.sample(rng, (hs, ws), min_valid_fraction)
 
         train_val = "train" if train else "val"
 
-        for blending_type, blending_method in BLENDING_METHODS.items():
+        # files of an interrupted run of the set are overwritten, its temporary
+        # files are removed
+        for folder in ["images", "labels", "mask", "shards"]:
+            remove_temp_files(f"{root}/{folder}/{train_val}", f"*{name}*")
 
-            for i, (img, smoke) in enumerate(zip(imgs, smoke_imgs)):
+        params = {image_format: encode_params(image_format, image_level)}
+        # generation parameters shared by the records of the set
+        set_record = {
+            "set_idx": set_idx,
+            "split": train_val,
+            "smoke": smoke_video_file,
+            "background": background_file,
+            "fx": fx,
+            "fy": fy,
+            "opacity": opacity,
+            "smoke_speed": smoke_speed,
+            "smoke_offset": smoke_offset,
+            "bg_start": bg_start,
+            "offset": [dy, dx],
+            "seed": seed,
+        }
+        n_samples = 0
 
-                result, mask = blending_method(img, smoke, offset=(dy, dx))
+        # images are encoded in the background, a given writer is only flushed
+        with ExitStack() as stack:
+            out = stack.enter_context(AsyncWriter()) if writer is None else writer
+            if manifest:
+                records = stack.enter_context(
+                    ManifestWriter(manifest_part(root, set_idx))
+                )
+            if shard_size > 0:
+                shards = ShardWriter(
+                    f"{root}/shards/{train_val}/{name}{{:04}}.tar",
+                    out,
+                    maxcount=shard_size,
+                    params=params,
+                )
+
+            # the full frame mask is only needed to be saved
+            blended = blend_frames(
+                zip(smoke_imgs, imgs),
+                (dy, dx),
+                opacity,
+                chunk_size,
+                roi_mask=not save_mask,
+                poisson_options=poisson_options,
+            )
+            for i, blending_type, result, mask, label in blended:
+
+                filename = blending_type + "_" + name + str(i).zfill(4)
 
-                label = get_label(mask * 255)
+                if manifest:
+                    # location relative to root
+                    if shard_size > 0:
+                        shard = n_samples // shard_size
+                        location = {"shard": f"shards/{train_val}/{name}{shard:04}.tar"}
+                    else:
+                        location = {
+                            "path": f"images/{train_val}/{filename}.{image_format}"
+                        }
+                    records.add(
+                        dict(
+                            set_record,
+                            frame=i,
+                            blending=blending_type,
+                            key=filename,
+                            bbox=[float(v) for v in label.split()[1:]] or None,
+                            **location,
+                        )
+                    )
+                n_samples += 1
+
+                # submitted arrays are not modified afterwards
+                if shard_size > 0:
+                    files = {image_format: result}
+                    if save_bbox:
+                        files["txt"] = label
+                    if save_mask:
+                        files["mask.jpg"] = mask * 255
+                    shards.save_sample(filename, files)
+                    continue
 
-                save_img(
+                out.save_img(
                     f"{root}/images/{train_val}/",
-                    blending_type + "_" + name + str(i).zfill(4) + ".png",
+                    filename + "." + image_format,
                     result,
+                    params[image_format],
                 )
                 if save_bbox:
-                    save_label(
-                        f"{root}/labels/{train_val}/",
-                        blending_type + "_" + name + str(i).zfill(4) + ".txt",
-                        label,
+                    out.save_label(
+                        f"{root}/labels/{train_val}/", filename + ".txt", label
                     )
                 if save_mask:
-                    save_img(
-                        f"{root}/mask/{train_val}/",
-                        blending_type + "_" + name + str(i).zfill(4) + ".jpg",
-                        mask * 255,
+                    out.save_img(
+                        f"{root}/mask/{train_val}/", filename + ".jpg", mask * 255
                     )
+
+            if shard_size > 0:
+                shards.close()
+            out.flush()
@@ -0,0 +1,104 @@
+# Copyright (C) 2019-2022, Pyronear.
+
+# This program is licensed under the Apache License version 2.
+# See LICENSE or go to <https://www.apache.org/licenses/LICENSE-2.0.txt> for full license details.
+
+import glob
+import json
+import os
+
+
+class ManifestWriter:
+    """Append JSON records to a JSONL file by batches. Records are written to a
+    temporary file which replaces path when closing, a partial manifest is
+    never left behind.
+
+    Args:
+        path (str): JSONL file
+        batch_size (int, optional): records buffered between writes. Defaults to 256.
+    """
+
+    def __init__(self, path, batch_size=256):
+        self.path = path
+        self.batch_size = batch_size
+        self._records = []
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._file = open(path + ".tmp", "w")
+
+    def add(self, record):
+        self._records.append(record)
+        if len(self._records) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        self._file.write("".join(json.dumps(record) + "\n" for record in self._records))
+        self._records = []
+
+    def close(self):
+        self.flush()
+        self._file.close()
+        os.replace(self.path + ".tmp", self.path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *exc):
+        if exc_type is None:
+            self.close()
+        else:
+            self._file.close()
+            os.remove(self.path + ".tmp")
+
+
+def manifest_part(root, set_idx):
+    """Manifest of one set"""
+    return f"{root}/manifest/set_{set_idx:03}.jsonl"
+
+
+def merge_manifest(root):
+    """Concatenate the manifests of the sets into root/manifest.jsonl, ordered
+    by set index
+
+    Args:
+        root (str): dataset folder
+
+    Returns:
+        int: number of records
+    """
+
+    def set_idx(part):
+        return int(os.path.basename(part)[len("set_") : -len(".jsonl")])
+
+    path = f"{root}/manifest.jsonl"
+    n_records = 0
+    with open(path + ".tmp", "w") as manifest:
+        for part in sorted(glob.glob(f"{root}/manifest/set_*.jsonl"), key=set_idx):
+            with open(part) as f:
+                lines = f.readlines()
+            manifest.writelines(lines)
+            n_records += len(lines)
+    os.replace(path + ".tmp", path)
+
+    return n_records
+
+
+def read_manifest(path, **filters):
+    """Iterate over the records of a manifest
+
+    Args:
+        path (str): JSONL file
+        filters: only yield records with these field values, a list or tuple
+            matches any of its values
+
+    Returns:
+        generator: records as dict
+    """
+    filters = {
+        key: value if isinstance(value, (list, tuple)) else (value,)
+        for key, value in filters.items()
+    }
+    with open(path) as f:
+        for line in f:
+            record = json.loads(line)
+            if all(record.get(key) in values for key, values in filters.items()):
+                yield record
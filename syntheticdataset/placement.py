@@ -0,0 +1,92 @@
+# Copyright (C) 2019-2022, Pyronear.
+
+# This program is licensed under the Apache License version 2.
+# See LICENSE or go to <https://www.apache.org/licenses/LICENSE-2.0.txt> for full license details.
+
+import cv2
+import numpy as np
+from syntheticdataset.cache import LRUCache
+
+
+def valid_mask(shape, ground=None, exclusion_zones=()):
+    """Pixels of a background where smoke can be placed
+
+    Args:
+        shape (tuple): height and width of the background
+        ground (np.array, optional): boolean mask of the pixels that are not sky,
+            every pixel is valid if None. Defaults to None.
+        exclusion_zones (list, optional): (y0, x0, y1, x1) boxes excluded, as
+            fractions of the height and width. Defaults to ().
+
+    Returns:
+        np.array: boolean mask of the valid pixels
+    """
+    h, w = shape
+    valid = np.ones((h, w), dtype=bool) if ground is None else ground.copy()
+    for y0, x0, y1, x1 in exclusion_zones:
+        valid[
+            int(y0 * h) : int(np.ceil(y1 * h)), int(x0 * w) : int(np.ceil(x1 * w))
+        ] = 0
+
+    return valid
+
+
+class Placement:
+    """Offsets of a smoke crop in a background whose bounding box overlaps the
+    valid pixels by a minimum fraction. The summed-area table of the valid
+    mask is built once, the overlap of each offset is then read in O(1).
+
+    Args:
+        valid (np.array): boolean mask of the valid pixels of the background
+    """
+
+    def __init__(self, valid):
+        self.shape = valid.shape
+        self.table = cv2.integral(valid.astype(np.uint8))
+        self.nbytes = self.table.nbytes
+
+    def overlap(self, smoke_shape):
+        """Fraction of valid pixels in the smoke box at every offset
+
+        Args:
+            smoke_shape (tuple): height and width of the smoke crop
+
+        Returns:
+            np.array: fraction of shape (h - hs, w - ws), indexed by (dy, dx)
+        """
+        hs, ws = smoke_shape
+        ny, nx = self.shape[0] - hs, self.shape[1] - ws
+        t = self.table
+        box_sum = (
+            t[hs : hs + ny, ws : ws + nx]
+            - t[:ny, ws : ws + nx]
+            - t[hs : hs + ny, :nx]
+            + t[:ny, :nx]
+        )
+        return box_sum / (hs * ws)
+
+    def sample(self, rng, smoke_shape, min_fraction=0.25):
+        """Draw an offset uniformly among the ones overlapping the valid pixels by
+        min_fraction, the most overlapping one when there is none
+
+        Args:
+            rng (random.Random): random generator
+            smoke_shape (tuple): height and width of the smoke crop
+            min_fraction (float, optional): minimum fraction of valid pixels in
+                the smoke box. Defaults to 0.25.
+
+        Returns:
+            tuple: offset (dy, dx)
+        """
+        fraction = self.overlap(smoke_shape)
+        candidates = np.flatnonzero(fraction >= min_fraction)
+        if len(candidates):
+            k = candidates[rng.randrange(len(candidates))]
+        else:
+            k = np.argmax(fraction)
+
+        return divmod(int(k), fraction.shape[1])
+
+
+# Placements of the backgrounds shared across sets
+PLACEMENT_CACHE = LRUCache(64 * 1024**2, sizeof=lambda placement: placement.nbytes)
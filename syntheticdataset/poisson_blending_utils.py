@@ -3,19 +3,33 @@
 # This program is licensed under the Apache License version 2.
 # See LICENSE or go to <https://www.apache.org/licenses/LICENSE-2.0.txt> for full license details.
 
+import cv2
+import hashlib
 import numpy as np
 import scipy.sparse
 import scipy.sparse.linalg
+from syntheticdataset.cache import LRUCache
+from syntheticdataset.poisson_solvers import (
+    conjugate_gradient,
+    dst_poisson,
+    multigrid,
+)
+
+
+def _factorization_nbytes(lu):
+    """Approximate memory held by a SuperLU factorization"""
+    return (lu.L.nnz + lu.U.nnz) * 12 + lu.perm_r.nbytes + lu.perm_c.nbytes
+
+
+# Factorizations of the poisson matrices, which only depend on the mask
+FACTORIZATION_CACHE = LRUCache(256 * 1024**2, sizeof=_factorization_nbytes)
 
 
 def create_mask(img_mask, img_target, img_src, offset=(0, 0)):
     """
     Takes the np.array from the grayscale image
+    img_target is only used for its shape, the cropped img_src is float32
     """
-    # Convert to float
-    img_mask = img_mask.astype(np.float64)
-    img_target = img_target.astype(np.float64)
-    img_src = img_src.astype(np.float64)
 
     # crop img_mask and img_src to fit to the img_target
     hm, wm = img_mask.shape
@@ -27,12 +41,8 @@ def create_mask(img_mask, img_target, img_src, offset=(0, 0)):
     hd1 = hm - max(hm + offset[0] - ht, 0)
     wd1 = wm - max(wm + offset[1] - wt, 0)
 
-    mask = np.zeros((hm, wm))
-    mask[img_mask > 0] = 1
-    mask[img_mask == 0] = 0
-
-    mask = mask[hd0:hd1, wd0:wd1]
-    src = img_src[hd0:hd1, wd0:wd1]
+    mask = (img_mask[hd0:hd1, wd0:wd1] > 0).astype(np.float32)
+    src = img_src[hd0:hd1, wd0:wd1].astype(np.float32)
 
     # fix offset
     offset_adj = (max(offset[0], 0), max(offset[1], 0))
@@ -96,9 +106,137 @@ def get_mixed_gradient_sum(img_src, img_target, i, j, h, w, ofs, c=1.0):
     return v_sum
 
 
-def poisson_blend(
+NEIGHBOURS = ((-1, 0), (1, 0), (0, -1), (0, 1))
+
+
+def get_gradient_field(img_src):
+    """
+    Return the sum of the gradient of the source image for every pixel at once.
+    * 3D array for RGB, the one pixel border is left to 0
+    """
+
+    field = np.zeros(img_src.shape)
+    field[1:-1, 1:-1] = (
+        img_src[1:-1, 1:-1] * 4
+        - img_src[2:, 1:-1]
+        - img_src[:-2, 1:-1]
+        - img_src[1:-1, 2:]
+        - img_src[1:-1, :-2]
+    )
+
+    return field
+
+
+def get_mixed_gradient_field(img_src, img_target, c=1.0):
+    """
+    Return the sum of the mixed gradient for every pixel at once.
+    * 3D array for RGB, the one pixel border is left to 0
+    * img_target is the region of the target image under img_src
+
+    c(>=0): larger, the more important the target image gradient is
+    """
+
+    hm, wm = img_src.shape[:2]
+    img_target = img_target.astype(np.float32)
+
+    field = np.zeros(img_src.shape)
+    for di, dj in [(1, 0), (-1, 0), (0, 1), (0, -1)]:
+        nb = (slice(1 + di, hm - 1 + di), slice(1 + dj, wm - 1 + dj))
+        fp = img_src[1:-1, 1:-1] - img_src[nb]
+        gp = img_target[1:-1, 1:-1] - img_target[nb]
+
+        field[1:-1, 1:-1] += np.where(np.abs(fp * c) > np.abs(gp), fp, gp)
+
+    return field
+
+
+def build_poisson_system(
+    img_mask,
+    img_src,
+    img_target,
+    method="mix",
+    c=1.0,
+    offset_adj=(0, 0),
+    domain="rect",
+):
+    """
+    Build the sparse system A x = F of the blending region in one pass.
+    The mask border must be empty (see create_mask) so that every masked pixel
+    has 4 neighbours.
+
+    domain="rect" makes an unknown of every pixel of the region (pixel (i, j)
+    is the unknown k = i + j * hm), domain="mask" only numbers the masked
+    pixels and folds their known neighbours into F.
+
+    Returns A, F and the (i, j) region coordinates of the unknowns
+    """
+
+    hm, wm = img_mask.shape
+
+    inside = img_mask == 1
+    target = img_target[
+        offset_adj[0] : offset_adj[0] + hm, offset_adj[1] : offset_adj[1] + wm
+    ]
+
+    # number the unknowns column by column
+    if domain == "mask":
+        uj, ui = np.nonzero(inside.T)
+    else:
+        uj, ui = np.divmod(np.arange(hm * wm), hm)
+    size = len(ui)
+
+    get_k = np.full((hm, wm), -1)
+    get_k[ui, uj] = np.arange(size)
+    F = target[ui, uj].astype(np.float64)
+
+    # plane insertion
+    if method in ["target", "src"]:
+        if method == "src":
+            src = inside[ui, uj]
+            F[src] = img_src[ui[src], uj[src]]
+
+        return scipy.sparse.identity(size, format="csr"), F, (ui, uj)
+
+    # poisson blending
+    ii, jj = np.nonzero(inside)
+    kk = get_k[ii, jj]
+
+    if method == "mix":
+        grad = get_mixed_gradient_field(img_src, target, c=c)[ii, jj]
+    else:
+        grad = get_gradient_field(img_src)[ii, jj]
+
+    diag = np.ones(size)
+    diag[kk] = 4
+    rows, cols, data = [np.arange(size)], [np.arange(size)], [diag]
+
+    f_star = np.zeros((len(kk), 3))
+    for di, dj in NEIGHBOURS:
+        ni, nj = ii + di, jj + dj
+        known = ~inside[ni, nj]
+
+        rows.append(kk[~known])
+        cols.append(get_k[ni, nj][~known])
+        data.append(-np.ones(np.count_nonzero(~known)))
+
+        f_star[known] += target[ni[known], nj[known]]
+
+    F[kk] = grad + f_star
+
+    A = scipy.sparse.csr_matrix(
+        (np.concatenate(data), (np.concatenate(rows), np.concatenate(cols))),
+        shape=(size, size),
+    )
+
+    return A, F, (ui, uj)
+
+
+def _build_poisson_system_loop(
     img_mask, img_src, img_target, method="mix", c=1.0, offset_adj=(0, 0)
 ):
+    """
+    Reference pixel by pixel assembly of build_poisson_system
+    """
 
     hm, wm = img_mask.shape
     region_size = hm * wm
@@ -167,20 +305,242 @@ def poisson_blend(
                 else:
                     F[k] = img_target[i + offset_adj[0], j + offset_adj[1]]
 
-    A = A.tocsr()
+    uj, ui = np.divmod(np.arange(region_size), hm)
+
+    return A.tocsr(), F, (ui, uj)
+
 
-    img_pro = np.empty_like(img_target.astype(np.uint8))
-    img_pro[:] = img_target.astype(np.uint8)
+def mask_digest(img_mask, domain="rect"):
+    """
+    Return a digest identifying the poisson matrix built from img_mask
+    """
+
+    inside = img_mask == 1
+    h = hashlib.sha1(f"{inside.shape}-{domain}".encode())
+    h.update(np.packbits(inside).tobytes())
+
+    return h.hexdigest()
+
+
+def factorize(A, key=None, cache=FACTORIZATION_CACHE):
+    """
+    Return the LU factorization of A, looked up in cache when key is given
+    """
+
+    lu = cache.get(key) if cache is not None and key is not None else None
+    if lu is None:
+        lu = scipy.sparse.linalg.splu(A.tocsc())
+        if cache is not None and key is not None:
+            cache.put(key, lu)
+
+    return lu
+
+
+def poisson_blend_fast(img_mask, img_src, img_target, offset_adj=(0, 0)):
+    """
+    Blend img_src into img_target over the whole region rectangle, its border
+    being the Dirichlet boundary. The mask only selects the guidance field: the
+    gradient of the source where img_mask == 1 and of the target elsewhere.
+    The system is solved in O(N log N) with a discrete sine transform.
+    """
+
+    hm, wm = img_mask.shape
+    target = img_target[
+        offset_adj[0] : offset_adj[0] + hm, offset_adj[1] : offset_adj[1] + wm
+    ].astype(np.float32)
+
+    img_pro = img_target.astype(np.uint8)
+
+    # no interior pixel
+    if hm < 3 or wm < 3:
+        return img_pro
+
+    # guidance gradient of every edge, from the source when it touches the mask
+    inside = (img_mask == 1)[:, :, None]
+    gy = np.where(
+        inside[:-1] | inside[1:], np.diff(img_src, axis=0), np.diff(target, axis=0)
+    )
+    gx = np.where(
+        inside[:, :-1] | inside[:, 1:],
+        np.diff(img_src, axis=1),
+        np.diff(target, axis=1),
+    )
+
+    # sum of the guidance gradient around each pixel
+    grad = np.zeros(target.shape)
+    grad[:-1] -= gy
+    grad[1:] += gy
+    grad[:, :-1] -= gx
+    grad[:, 1:] += gx
+
+    # known border values go to the right hand side
+    F = grad[1:-1, 1:-1]
+    F[0] += target[0, 1:-1]
+    F[-1] += target[-1, 1:-1]
+    F[:, 0] += target[1:-1, 0]
+    F[:, -1] += target[1:-1, -1]
+
+    x = dst_poisson(F)
+    x[x > 255] = 255
+    x[x < 0] = 0
+    img_pro[
+        offset_adj[0] + 1 : offset_adj[0] + hm - 1,
+        offset_adj[1] + 1 : offset_adj[1] + wm - 1,
+    ] = np.array(x, img_pro.dtype)
+
+    return img_pro
+
+
+def poisson_blend(
+    img_mask,
+    img_src,
+    img_target,
+    method="mix",
+    c=1.0,
+    offset_adj=(0, 0),
+    assembly="vectorized",
+    domain="rect",
+    cache=FACTORIZATION_CACHE,
+    solver="direct",
+    x0=None,
+    tol=1e-3,
+    maxiter=None,
+):
+    """
+    Blend img_src into img_target where img_mask == 1
 
-    for l in range(3):
-        # x = pyamg.solve(A, F[:, l], verb=True, tol=1e-15, maxiter=100)
-        x = scipy.sparse.linalg.spsolve(A, F[:, l])
-        x[x > 255] = 255
-        x[x < 0] = 0
-        x = np.array(x, img_pro.dtype)
+    solver="direct" factorizes the system (see factorize), solver="cg" and
+    solver="multigrid" are approximate iterative solvers stopping at the
+    relative residual tol or after maxiter iterations. They start from x0, an
+    image of the size of img_target such as the result of the previous frame.
+
+    method="fast" solves the whole region rectangle instead (see
+    poisson_blend_fast).
+    """
+
+    if method == "fast":
+        return poisson_blend_fast(img_mask, img_src, img_target, offset_adj)
+
+    if assembly == "loop":
+        domain = "rect"
+        A, F, (ui, uj) = _build_poisson_system_loop(
+            img_mask, img_src, img_target, method=method, c=c, offset_adj=offset_adj
+        )
+    else:
+        A, F, (ui, uj) = build_poisson_system(
+            img_mask,
+            img_src,
+            img_target,
+            method=method,
+            c=c,
+            offset_adj=offset_adj,
+            domain=domain,
+        )
+
+    img_pro = img_target.astype(np.uint8)
+
+    # nothing to solve for an empty mask
+    if len(ui) == 0:
+        return img_pro
+
+    kwargs = {} if maxiter is None else {"maxiter": maxiter}
+    if x0 is not None:
+        x0 = x0[offset_adj[0] + ui, offset_adj[1] + uj].astype(np.float64)
+
+    # plane insertion is an identity system
+    if method in ["target", "src"]:
+        x = F
+    elif solver in ["cg", "multigrid"]:
+        # only the masked unknowns are coupled, the others are known
+        inside = img_mask == 1
+        sel = inside[ui, uj]
+        mi, mj = ui[sel], uj[sel]
+        x = F.copy()
+        x0 = None if x0 is None else x0[sel]
+
+        if solver == "cg":
+            A = A[sel][:, sel]
+            x[sel], _ = conjugate_gradient(A, F[sel], x0=x0, tol=tol, **kwargs)
+        else:
+            b = np.zeros(img_mask.shape + (3,))
+            b[mi, mj] = F[sel]
+            if x0 is not None:
+                x0_grid = np.zeros(b.shape)
+                x0_grid[mi, mj] = x0
+                x0 = x0_grid
+
+            x_grid, _ = multigrid(inside, b, x0=x0, tol=tol, **kwargs)
+            x[sel] = x_grid[mi, mj]
+    else:
+        lu = factorize(A, key=mask_digest(img_mask, domain), cache=cache)
+        x = lu.solve(F)
+
+    x[x > 255] = 255
+    x[x < 0] = 0
+    img_pro[offset_adj[0] + ui, offset_adj[1] + uj] = np.array(x, img_pro.dtype)
+
+    return img_pro
+
+
+def poisson_blend_pyramid(
+    img_mask,
+    img_src,
+    img_target,
+    method="normal",
+    c=1.0,
+    offset_adj=(0, 0),
+    levels=1,
+    refine_iters=10,
+):
+    """
+    Approximate poisson_blend: the blend is solved at a resolution reduced by
+    2 ** levels, the correction (solution - source) is upsampled and refined
+    with refine_iters conjugate gradient iterations at full resolution.
+    """
+
+    hm, wm = img_mask.shape
+    target = img_target[
+        offset_adj[0] : offset_adj[0] + hm, offset_adj[1] : offset_adj[1] + wm
+    ].astype(np.float32)
+    src = img_src.astype(np.float32)
+
+    # coarse solve
+    size = (max(wm >> levels, 3), max(hm >> levels, 3))
+    mask_small = cv2.resize(
+        img_mask.astype(np.uint8), size, interpolation=cv2.INTER_NEAREST
+    )
+    mask_small[[0, -1]] = 0
+    mask_small[:, [0, -1]] = 0
+    src_small = cv2.resize(src, size, interpolation=cv2.INTER_AREA)
+    res_small = poisson_blend(
+        mask_small,
+        src_small,
+        cv2.resize(target, size, interpolation=cv2.INTER_AREA),
+        method=method,
+        c=c,
+        domain="mask",
+    )
+
+    # upsampled correction as the initial guess of the full resolution solve
+    correction = cv2.resize(
+        res_small - src_small, (wm, hm), interpolation=cv2.INTER_LINEAR
+    )
+    res = poisson_blend(
+        img_mask,
+        src,
+        target,
+        method=method,
+        c=c,
+        domain="mask",
+        solver="cg",
+        x0=src + correction,
+        tol=1e-6,
+        maxiter=refine_iters,
+    )
 
-        img_pro[
-            offset_adj[0] : offset_adj[0] + hm, offset_adj[1] : offset_adj[1] + wm, l
-        ] = x.reshape(hm, wm, order="F")
+    img_pro = img_target.astype(np.uint8)
+    img_pro[
+        offset_adj[0] : offset_adj[0] + hm, offset_adj[1] : offset_adj[1] + wm
+    ] = res
 
     return img_pro
@@ -0,0 +1,176 @@
+# Copyright (C) 2019-2022, Pyronear.
+
+# This program is licensed under the Apache License version 2.
+# See LICENSE or go to <https://www.apache.org/licenses/LICENSE-2.0.txt> for full license details.
+
+import numpy as np
+import scipy.fft
+
+
+def _converged(r, b_norm, tol):
+    return np.all(np.linalg.norm(r, axis=0) <= tol * b_norm)
+
+
+def _safe_divide(a, b):
+    return np.divide(a, b, out=np.zeros_like(a), where=b != 0)
+
+
+def conjugate_gradient(A, b, x0=None, tol=1e-3, maxiter=None, M=None):
+    """Jacobi preconditioned conjugate gradient solving A x = b for every column of b
+
+    Args:
+        A (scipy.sparse matrix): symmetric positive definite matrix of shape (n, n)
+        b (np.array): right hand sides of shape (n, k)
+        x0 (np.array, optional): initial guess of shape (n, k). Defaults to 0.
+        tol (float, optional): relative residual norm to reach. Defaults to 1e-3.
+        maxiter (int, optional): maximum number of iterations. Defaults to n.
+        M (np.array, optional): inverse of the preconditioner diagonal.
+            Defaults to the inverse of A diagonal.
+
+    Returns:
+        np.array: solution of shape (n, k)
+        int: number of iterations
+    """
+
+    M = 1 / A.diagonal() if M is None else M
+    maxiter = A.shape[0] if maxiter is None else maxiter
+
+    x = np.zeros(b.shape) if x0 is None else np.array(x0, dtype=np.float64)
+    r = b - A @ x
+    z = M[:, None] * r
+    p = z.copy()
+    rz = np.sum(r * z, axis=0)
+    b_norm = np.linalg.norm(b, axis=0)
+
+    for it in range(maxiter):
+        if _converged(r, b_norm, tol):
+            return x, it
+
+        Ap = A @ p
+        alpha = _safe_divide(rz, np.sum(p * Ap, axis=0))
+        x += alpha * p
+        r -= alpha * Ap
+
+        z = M[:, None] * r
+        rz_new = np.sum(r * z, axis=0)
+        p = z + _safe_divide(rz_new, rz) * p
+        rz = rz_new
+
+    return x, maxiter
+
+
+def _laplacian(x, inside):
+    """5-point laplacian (4 x - neighbours) with x = 0 outside of inside"""
+
+    y = 4 * x
+    y[1:] -= x[:-1]
+    y[:-1] -= x[1:]
+    y[:, 1:] -= x[:, :-1]
+    y[:, :-1] -= x[:, 1:]
+    y[~inside] = 0
+
+    return y
+
+
+def _smooth(x, b, inside, sweeps, omega=0.8):
+    """Weighted Jacobi sweeps"""
+
+    for _ in range(sweeps):
+        x += omega / 4 * (b - _laplacian(x, inside))
+
+    return x
+
+
+def _restrict(r):
+    """Sum of 2x2 blocks, the grid is zero padded to an even size"""
+
+    h, w = r.shape[:2]
+    r = np.pad(r, [(0, h % 2), (0, w % 2)] + [(0, 0)] * (r.ndim - 2))
+
+    return r[0::2, 0::2] + r[1::2, 0::2] + r[0::2, 1::2] + r[1::2, 1::2]
+
+
+def _prolong(e, shape):
+    """Bilinear cell centered interpolation with zero values outside the grid"""
+
+    def interp(e, axis):
+        e = np.moveaxis(e, axis, 0)
+        pad = np.pad(e, [(1, 1)] + [(0, 0)] * (e.ndim - 1))
+        fine = np.empty((2 * e.shape[0],) + e.shape[1:])
+        fine[0::2] = 0.75 * e + 0.25 * pad[:-2]
+        fine[1::2] = 0.75 * e + 0.25 * pad[2:]
+        return np.moveaxis(fine, 0, axis)
+
+    return interp(interp(e, 0), 1)[: shape[0], : shape[1]]
+
+
+def _v_cycle(x, b, inside, sweeps):
+
+    h, w = inside.shape
+    if min(h, w) < 8:
+        return _smooth(x, b, inside, 20 * sweeps)
+
+    x = _smooth(x, b, inside, sweeps)
+
+    # coarse grid correction, the coarse spacing is twice the fine one
+    inside_c = _restrict(inside.astype(np.uint8)) == 4
+    r_c = _restrict(b - _laplacian(x, inside))
+    r_c[~inside_c] = 0
+    e_c = _v_cycle(np.zeros(r_c.shape), r_c, inside_c, sweeps)
+    x += _prolong(e_c, (h, w)) * inside[:, :, None]
+
+    return _smooth(x, b, inside, sweeps)
+
+
+def multigrid(inside, b, x0=None, tol=1e-3, maxiter=50, sweeps=2):
+    """Geometric multigrid V-cycles solving the 5-point poisson equation
+
+    Args:
+        inside (np.array): boolean mask of the unknowns of shape (h, w),
+            pixels outside of the mask are zero (homogeneous Dirichlet)
+        b (np.array): right hand sides of shape (h, w, k)
+        x0 (np.array, optional): initial guess of shape (h, w, k). Defaults to 0.
+        tol (float, optional): relative residual norm to reach. Defaults to 1e-3.
+        maxiter (int, optional): maximum number of V-cycles. Defaults to 50.
+        sweeps (int, optional): smoothing sweeps before and after the coarse
+            correction. Defaults to 2.
+
+    Returns:
+        np.array: solution of shape (h, w, k)
+        int: number of V-cycles
+    """
+
+    b = b * inside[:, :, None]
+    x = np.zeros(b.shape) if x0 is None else x0 * inside[:, :, None]
+    b_norm = np.linalg.norm(b.reshape(-1, b.shape[2]), axis=0)
+
+    for it in range(maxiter):
+        r = b - _laplacian(x, inside)
+        if _converged(r.reshape(-1, b.shape[2]), b_norm, tol):
+            return x, it
+
+        x = _v_cycle(x, b, inside, sweeps)
+
+    return x, maxiter
+
+
+def dst_poisson(b):
+    """Solve the 5-point poisson equation on a rectangle with a discrete sine transform
+
+    Args:
+        b (np.array): right hand sides of shape (h, w, k), pixels outside of the
+            rectangle are zero (homogeneous Dirichlet)
+
+    Returns:
+        np.array: solution of shape (h, w, k)
+    """
+
+    h, w = b.shape[:2]
+    # eigenvalues of 4 x - neighbours in the sine basis
+    ly = 2 - 2 * np.cos(np.pi * np.arange(1, h + 1) / (h + 1))
+    lx = 2 - 2 * np.cos(np.pi * np.arange(1, w + 1) / (w + 1))
+
+    x = scipy.fft.dstn(b, type=1, axes=(0, 1), norm="ortho")
+    x /= (ly[:, None] + lx[None, :])[:, :, None]
+
+    return scipy.fft.idstn(x, type=1, axes=(0, 1), norm="ortho")
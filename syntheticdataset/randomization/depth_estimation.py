@@ -3,8 +3,13 @@
 # This program is licensed under the Apache License version 2.
 # See LICENSE or go to <https://www.apache.org/licenses/LICENSE-2.0.txt> for full license details.
 
+import cv2
+import json
+import os
+import time
 import torch
 import numpy as np
+from syntheticdataset.utils import select_keyframes
 
 
 # Depth Deep Learning Model
@@ -19,24 +24,245 @@ MIDAS_SMALL = (
 )
 
 
+# Resizing and normalization of the MiDaS hub transforms
+TRANSFORM_CONFIGS = {
+    MIDAS_LARGE: {
+        "size": 384,
+        "resize_method": "minimal",
+        "mean": [0.5, 0.5, 0.5],
+        "std": [0.5, 0.5, 0.5],
+    },
+    MIDAS_HYBRID: {
+        "size": 384,
+        "resize_method": "minimal",
+        "mean": [0.5, 0.5, 0.5],
+        "std": [0.5, 0.5, 0.5],
+    },
+    MIDAS_SMALL: {
+        "size": 256,
+        "resize_method": "upper_bound",
+        "mean": [0.485, 0.456, 0.406],
+        "std": [0.229, 0.224, 0.225],
+    },
+}
+
+# torch.inference_mode appeared in torch 1.9
+inference_mode = getattr(torch, "inference_mode", torch.no_grad)
+
+
+def _multiple_of_32(x, min_val=0, max_val=None):
+    y = int(np.round(x / 32) * 32)
+    if max_val is not None and y > max_val:
+        y = int(np.floor(x / 32) * 32)
+    if y < min_val:
+        y = int(np.ceil(x / 32) * 32)
+    return y
+
+
+def midas_transform(model_type):
+    """
+    Transform of the MiDaS hub, without downloading it
+
+    Args:
+        model_type (str): MIDAS_LARGE, MIDAS_HYBRID or MIDAS_SMALL
+
+    Returns:
+        callable: RGB image to a normalized 1x3xHxW tensor, H and W multiples of 32
+    """
+
+    config = TRANSFORM_CONFIGS[model_type]
+    size = config["size"]
+    mean = np.array(config["mean"], dtype=np.float32)
+    std = np.array(config["std"], dtype=np.float32)
+
+    def transform(img):
+        h, w = img.shape[:2]
+        scale_h, scale_w = size / h, size / w
+        if config["resize_method"] == "minimal":
+            # scale as little as possible, the sides are at least size
+            scale = scale_w if abs(1 - scale_w) < abs(1 - scale_h) else scale_h
+            new_h = _multiple_of_32(scale * h, min_val=size)
+            new_w = _multiple_of_32(scale * w, min_val=size)
+        else:
+            # the sides are at most size
+            scale = min(scale_h, scale_w)
+            new_h = _multiple_of_32(scale * h, max_val=size)
+            new_w = _multiple_of_32(scale * w, max_val=size)
+
+        img = cv2.resize(
+            img.astype(np.float32) / 255, (new_w, new_h), interpolation=cv2.INTER_CUBIC
+        )
+        img = (img - mean) / std
+        return torch.from_numpy(np.ascontiguousarray(img.transpose(2, 0, 1)))[None]
+
+    return transform
+
+
+def load_model(model_type=MIDAS_LARGE, hub_dir=None, checkpoint=None):
+    """
+    Load a MiDaS model from the hub, or offline from a local clone of the
+    MiDaS repository and a checkpoint
+
+    Args:
+        model_type (str): MIDAS_LARGE, MIDAS_HYBRID or MIDAS_SMALL
+        hub_dir (str): local clone of intel-isl/MiDaS, the hub if None
+        checkpoint (str): state dict of the model, the torch hub cache if None
+
+    Returns:
+        torch.nn.Module: model in eval mode
+    """
+
+    if hub_dir is None:
+        model = torch.hub.load("intel-isl/MiDaS", model_type)
+    else:
+        model = torch.hub.load(
+            hub_dir, model_type, source="local", pretrained=checkpoint is None
+        )
+        if checkpoint is not None:
+            model.load_state_dict(torch.load(checkpoint, map_location="cpu"))
+
+    return model.eval()
+
+
+def export_model(
+    path,
+    model_type=MIDAS_LARGE,
+    input_shape=(384, 672),
+    quantize=False,
+    hub_dir=None,
+    checkpoint=None,
+):
+    """
+    Export a MiDaS model to TorchScript (.pt) or ONNX (.onnx) for CPU inference,
+    with its configuration in path.json. Exported models take inputs of
+    input_shape, frames are resized to it.
+
+    Args:
+        path (str): exported model, its extension selects the format
+        model_type (str): MIDAS_LARGE, MIDAS_HYBRID or MIDAS_SMALL
+        input_shape (tuple): height and width of the network input
+        quantize (bool): dynamic int8 quantization of the weights, ONNX models
+            are quantized with onnxruntime
+        hub_dir (str): local clone of intel-isl/MiDaS, the hub if None
+        checkpoint (str): state dict of the model, the torch hub cache if None
+
+    Returns:
+        dict: configuration of the exported model
+    """
+
+    model = load_model(model_type, hub_dir, checkpoint)
+    example = torch.rand(1, 3, *input_shape)
+
+    if path.endswith(".onnx"):
+        onnx_path = path + ".fp32" if quantize else path
+        torch.onnx.export(
+            model,
+            example,
+            onnx_path,
+            input_names=["image"],
+            output_names=["depth"],
+            dynamic_axes={"image": {0: "batch"}, "depth": {0: "batch"}},
+            opset_version=13,
+        )
+        if quantize:
+            from onnxruntime.quantization import QuantType, quantize_dynamic
+
+            quantize_dynamic(onnx_path, path, weight_type=QuantType.QInt8)
+            os.remove(onnx_path)
+    else:
+        if quantize:
+            # the weights of the linear layers, most of the DPT transformers
+            model = torch.quantization.quantize_dynamic(
+                model, {torch.nn.Linear}, dtype=torch.qint8
+            )
+        with torch.no_grad():
+            torch.jit.save(torch.jit.trace(model, example), path)
+
+    config = {
+        "model_type": model_type,
+        "input_shape": list(input_shape),
+        "quantized": quantize,
+    }
+    with open(path + ".json", "w") as f:
+        json.dump(config, f)
+
+    return config
+
+
+def load_exported_model(path, device=torch.device("cpu")):
+    """
+    Load a model made by export_model
+
+    Returns:
+        tuple: callable model mapping a batch to its depth, and its configuration
+    """
+
+    with open(path + ".json") as f:
+        config = json.load(f)
+
+    if path.endswith(".onnx"):
+        import onnxruntime
+
+        session = onnxruntime.InferenceSession(path, providers=["CPUExecutionProvider"])
+
+        def model(input):
+            (depth,) = session.run(None, {"image": input.cpu().numpy()})
+            return torch.from_numpy(depth)
+
+    else:
+        model = torch.jit.load(path, map_location=device).eval()
+
+    return model, config
+
+
 class DepthEstimation:
-    def __init__(self, model_type=MIDAS_LARGE):
+    """
+    MiDaS depth estimation
+
+    Args:
+        model_type (str): MIDAS_LARGE, MIDAS_HYBRID or MIDAS_SMALL
+        num_threads (int): number of intra-op CPU threads, torch default if None
+        input_size (int): height of the network input, multiple of 32, the
+            resolution of the model transform if None
+        hub_dir (str): local clone of intel-isl/MiDaS to load the model
+            offline, the hub if None
+        checkpoint (str): state dict of the model, the torch hub cache if None
+        model_path (str): model made by export_model, replaces the MiDaS model
+            and sets model_type and the input shape
+    """
+
+    def __init__(
+        self,
+        model_type=MIDAS_LARGE,
+        num_threads=None,
+        input_size=None,
+        hub_dir=None,
+        checkpoint=None,
+        model_path=None,
+    ):
+
+        if num_threads is not None:
+            torch.set_num_threads(num_threads)
+        self.input_size = input_size
+        self.input_shape = None
+        self.reset_stats()
 
-        # Preloading model
-        self.midas = torch.hub.load("intel-isl/MiDaS", model_type)
         self.device = (
             torch.device("cuda") if torch.cuda.is_available() else torch.device("cpu")
         )
-        self.midas.to(self.device)
-        self.midas.eval()
 
-        midas_transforms = torch.hub.load("intel-isl/MiDaS", "transforms")
+        # Preloading model
+        if model_path is not None:
+            self.midas, config = load_exported_model(model_path, self.device)
+            model_type = config["model_type"]
+            self.input_shape = tuple(config["input_shape"])
+        else:
+            self.midas = load_model(model_type, hub_dir, checkpoint)
+            self.midas.to(self.device)
+        self.model_type = model_type
 
-        self.transform = (
-            midas_transforms.dpt_transform
-            if model_type == MIDAS_LARGE or model_type == MIDAS_HYBRID
-            else midas_transforms.small_transform
-        )
+        # the transforms of the hub are reimplemented to avoid a second download
+        self.transform = midas_transform(model_type)
 
     def _scale_output(self, output):
         """
@@ -53,6 +279,89 @@ class DepthEstimation:
         """
         return (output / 40 * 255).astype(int)
 
+    def reset_stats(self):
+        """Reset the throughput counters"""
+        self.n_frames = 0
+        self.n_batches = 0
+        self.inference_time = 0.0
+        # frames of sequences whose depth was reused instead of estimated
+        self.n_saved = 0
+
+    def stats(self):
+        """
+        Throughput of the depth estimation since the last reset
+
+        Returns:
+            dict: frames, batches, frames per second, milliseconds per batch and
+            model calls saved by keyframes
+        """
+        return {
+            "frames": self.n_frames,
+            "batches": self.n_batches,
+            "saved": self.n_saved,
+            "frames_per_s": self.n_frames / self.inference_time
+            if self.inference_time
+            else 0.0,
+            "ms_per_batch": 1000 * self.inference_time / self.n_batches
+            if self.n_batches
+            else 0.0,
+        }
+
+    def _resize_input(self, input):
+        """Resize the transformed batch to the input shape of an exported model,
+        or to input_size keeping the aspect ratio"""
+        if self.input_shape is not None:
+            size = self.input_shape
+        else:
+            h, w = input.shape[2:]
+            size = (
+                self.input_size,
+                max(32, int(round(w * self.input_size / h / 32)) * 32),
+            )
+        return torch.nn.functional.interpolate(
+            input, size=size, mode="bilinear", align_corners=False
+        )
+
+    def estimate_depth_from_batch(self, imgs, batch_size=8):
+        """
+        Estimate the depth of frames of the same size, batch_size frames per
+        forward pass
+
+        Args:
+            imgs (list): background images of the same size
+            batch_size (int): number of frames per forward pass
+
+        Returns:
+            list: result depth images
+        """
+
+        outputs = []
+        for i in range(0, len(imgs), batch_size):
+            batch = imgs[i : i + batch_size]
+            start = time.perf_counter()
+
+            input = torch.cat([self.transform(img) for img in batch]).to(self.device)
+            if self.input_size is not None or self.input_shape is not None:
+                input = self._resize_input(input)
+
+            with inference_mode():
+                prediction = self.midas(input)
+                # a single upsampling for the batch
+                prediction = torch.nn.functional.interpolate(
+                    prediction.unsqueeze(1),
+                    size=batch[0].shape[:2],
+                    mode="bicubic",
+                    align_corners=False,
+                ).squeeze(1)
+
+            outputs.extend(self._scale_output(prediction.cpu().numpy()))
+
+            self.inference_time += time.perf_counter() - start
+            self.n_batches += 1
+            self.n_frames += len(batch)
+
+        return outputs
+
     def estimate_depth_from_image(self, img):
         """
         Estimate the depth the image pixel by pixel with Torch
@@ -64,21 +373,53 @@ class DepthEstimation:
             np.array: result depth image
         """
 
-        print(img.shape)
-        input = self.transform(img).to(self.device)
+        return self.estimate_depth_from_batch([img])[0]
 
-        with torch.no_grad():
-            prediction = self.midas(input)
-            prediction = torch.nn.functional.interpolate(
-                prediction.unsqueeze(1),
-                size=img.shape[:2],
-                mode="bicubic",
-                align_corners=False,
-            ).squeeze()
+    def estimate_depth_from_sequence(
+        self,
+        imgs,
+        threshold=8.0,
+        max_interval=25,
+        interpolate=False,
+        batch_size=8,
+    ):
+        """
+        Estimate the depth of the frames of a static camera video, the model
+        only runs on keyframes, see select_keyframes
+
+        Args:
+            imgs (list): background images of the same size
+            threshold (float): mean absolute difference triggering a keyframe
+            max_interval (int): maximum number of frames between two keyframes
+            interpolate (bool): interpolate the depth between two keyframes
+                instead of reusing the depth of the last one
+            batch_size (int): number of frames per forward pass
 
-        output = prediction.cpu().numpy()
+        Returns:
+            list: result depth images, the frames reusing the depth of a
+            keyframe share its array
+        """
 
-        return self._scale_output(output)
+        keyframes = select_keyframes(imgs, threshold, max_interval)
+        depths = self.estimate_depth_from_batch(
+            [imgs[i] for i in keyframes], batch_size
+        )
+        self.n_saved += len(imgs) - len(keyframes)
+
+        outputs = []
+        for k, (start, depth) in enumerate(zip(keyframes, depths)):
+            end = keyframes[k + 1] if k + 1 < len(keyframes) else len(imgs)
+            outputs.append(depth)
+            for i in range(start + 1, end):
+                if interpolate and end < len(imgs):
+                    alpha = (i - start) / (end - start)
+                    outputs.append(
+                        ((1 - alpha) * depth + alpha * depths[k + 1]).astype(int)
+                    )
+                else:
+                    outputs.append(depth)
+
+        return outputs
 
     def generate_mask(self, depth_image, min_threshold, max_threshold):
         """
@@ -120,3 +461,63 @@ class DepthEstimation:
         depth_image = self.estimate_depth_from_image(img)
 
         return self.generate_mask(depth_image, min_threshold, max_threshold)
+
+    def detect_sky_from_frames(
+        self, imgs, min_threshold=60, max_threshold=170, batch_size=8
+    ):
+        """
+        Generate the masks without the sky of frames of the same size,
+        estimating their depth by batches
+
+        Args:
+            imgs (list): background images of the same size
+            min_threshold (int): min pixel value not to be considered as sky
+            max_threshold (int): max pixel value not to be considered as sky
+            batch_size (int): number of frames per forward pass
+
+        Returns:
+            list: result mask images
+        """
+
+        return [
+            self.generate_mask(depth_image, min_threshold, max_threshold)
+            for depth_image in self.estimate_depth_from_batch(imgs, batch_size)
+        ]
+
+    def detect_sky_from_sequence(
+        self,
+        imgs,
+        min_threshold=60,
+        max_threshold=170,
+        threshold=8.0,
+        max_interval=25,
+        batch_size=8,
+    ):
+        """
+        Generate the masks without the sky of the frames of a static camera
+        video, estimating the depth of keyframes only
+
+        Args:
+            imgs (list): background images of the same size
+            min_threshold (int): min pixel value not to be considered as sky
+            max_threshold (int): max pixel value not to be considered as sky
+            threshold (float): mean absolute difference triggering a keyframe
+            max_interval (int): maximum number of frames between two keyframes
+            batch_size (int): number of frames per forward pass
+
+        Returns:
+            list: result mask images
+        """
+
+        depths = self.estimate_depth_from_sequence(
+            imgs, threshold, max_interval, batch_size=batch_size
+        )
+        # generate_mask works in place, reused depth images are only masked once
+        masks, previous = [], None
+        for depth in depths:
+            if depth is not previous:
+                mask = self.generate_mask(depth, min_threshold, max_threshold)
+                previous = depth
+            masks.append(mask)
+
+        return masks
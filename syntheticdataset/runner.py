@@ -0,0 +1,295 @@
+# Copyright (C) 2019-2022, Pyronear.
+
+# This program is licensed under the Apache License version 2.
+# See LICENSE or go to <https://www.apache.org/licenses/LICENSE-2.0.txt> for full license details.
+
+import cv2
+import hashlib
+import heapq
+import math
+import os
+import random
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from functools import lru_cache
+from syntheticdataset.make_set import make_one_set
+from syntheticdataset.poisson_blending_utils import FACTORIZATION_CACHE
+from syntheticdataset.utils import FRAME_CACHE, get_video_length, get_video_size
+from syntheticdataset.writer import AsyncWriter
+from tqdm import tqdm
+
+
+def set_seed(seed, set_key):
+    """Seed of a set, derived from the run seed and the set index or name"""
+    digest = hashlib.sha256(f"{seed}-{set_key}".encode()).digest()
+    return int.from_bytes(digest[:8], "little")
+
+
+def draw_set_params(rng):
+    """Random blending parameters of a set"""
+    return {
+        "fx": rng.randint(1, 9) / 10,  # random in [0.1, 0.9]
+        "fy": rng.randint(1, 9) / 10,  # random in [0.1, 0.9]
+        "opacity": rng.randint(4, 10) / 10,  # random in [0.4, 1.0]
+        "smoke_speed": rng.randint(3, 10),  # random in [3, 10]
+    }
+
+
+def plan_random_sets(smoke_videos, background_videos, n_sets, seed):
+    """Draw n_sets (smoke, background) pairs with replacement
+
+    Returns:
+        list: make_one_set keyword arguments of every set
+    """
+
+    smoke_videos, background_videos = sorted(smoke_videos), sorted(background_videos)
+    cut_val = int(n_sets * 0.8)
+
+    plan = []
+    for set_idx in range(n_sets):
+        rng = random.Random(set_seed(seed, set_idx))
+        plan.append(
+            {
+                "smoke_video_file": rng.choice(smoke_videos),
+                "background_file": rng.choice(background_videos),
+                "set_idx": set_idx,
+                "train": set_idx < cut_val,
+                **draw_set_params(rng),
+                "seed": rng.getrandbits(64),
+            }
+        )
+
+    return plan
+
+
+def plan_all_sets(smoke_videos, background_videos, seed, planned=()):
+    """Cross every smoke video with every background video. Sets only depend on
+    their pair of videos: the planned sets keep their index and split, whether
+    they are completed or not, and new pairs are numbered after them, so adding
+    videos only adds their sets.
+
+    Args:
+        smoke_videos (list): smoke video files
+        background_videos (list): background video files
+        seed (int): seed of the run
+        planned (list, optional): tasks of the sets planned by previous runs, see
+            Journal.plan. Defaults to ().
+
+    Returns:
+        list: make_one_set keyword arguments of every set
+    """
+
+    smoke_videos, background_videos = sorted(smoke_videos), sorted(background_videos)
+    cut_val = int(len(background_videos) * 0.8)
+
+    set_idxs = {
+        (t["smoke_video_file"], t["background_file"]): t["set_idx"] for t in planned
+    }
+    # a background stays in the same split when videos are added
+    splits = {t["background_file"]: t["train"] for t in planned}
+    next_idx = max(set_idxs.values(), default=-1) + 1
+
+    plan = []
+    for smoke_video_file in smoke_videos:
+        for i, background_file in enumerate(background_videos):
+            pair = (smoke_video_file, background_file)
+            if pair in set_idxs:
+                set_idx = set_idxs[pair]
+            else:
+                set_idx, next_idx = next_idx, next_idx + 1
+            rng = random.Random(
+                set_seed(seed, "|".join(os.path.basename(f) for f in pair))
+            )
+            plan.append(
+                {
+                    "smoke_video_file": smoke_video_file,
+                    "background_file": background_file,
+                    "set_idx": set_idx,
+                    "train": splits.get(background_file, i < cut_val),
+                    **draw_set_params(rng),
+                    "seed": rng.getrandbits(64),
+                }
+            )
+
+    return plan
+
+
+@lru_cache(maxsize=None)
+def video_info(file, size_max):
+    """Number of frames and number of pixels once resized of a video"""
+    h, w = get_video_size(file)
+    r = min(size_max / max(h, w, 1), 1)
+    return get_video_length(file), h * w * r * r
+
+
+def estimate_set_cost(task):
+    """Rough cost of a set: number of blended frames times the pixels of a
+    background frame plus the pixels of a resized smoke frame"""
+    smoke_length, smoke_pixels = video_info(
+        task["smoke_video_file"], task.get("size_max_smoke", 1280)
+    )
+    bg_length, bg_pixels = video_info(
+        task["background_file"], task.get("size_max_bg", 1280)
+    )
+    n_frames = math.ceil(
+        max(smoke_length - task.get("smoke_offset", 20), 0) / task["smoke_speed"]
+    )
+    smoke_pixels *= task["fx"] * task["fy"]
+    return min(n_frames, bg_length) * (bg_pixels + smoke_pixels)
+
+
+def assign_shard(tasks, num_shards, shard_index, cost=estimate_set_cost):
+    """Sets of one of num_shards shards of a run. Sets are given to the least
+    loaded shard from the most costly one, every node computes the same split.
+
+    Args:
+        tasks (list): make_one_set keyword arguments of every set
+        num_shards (int): number of shards
+        shard_index (int): index of the shard, in [0, num_shards)
+        cost (callable, optional): cost of a task. Defaults to estimate_set_cost.
+
+    Returns:
+        list: tasks of the shard, in set index order
+    """
+    if not 0 <= shard_index < num_shards:
+        raise ValueError(f"Shard index {shard_index} not in [0, {num_shards})")
+
+    costs = sorted(((-cost(task), task["set_idx"]) for task in tasks))
+    # (load, shard index) heap
+    loads = [(0, i) for i in range(num_shards)]
+    assigned = set()
+    for task_cost, set_idx in costs:
+        load, i = heapq.heappop(loads)
+        if i == shard_index:
+            assigned.add(set_idx)
+        heapq.heappush(loads, (load - task_cost, i))
+
+    return [task for task in tasks if task["set_idx"] in assigned]
+
+
+def cache_stats():
+    """Counters of the caches of the current process"""
+    return {
+        "Decoded frame": FRAME_CACHE.stats(),
+        "Poisson factorization": FACTORIZATION_CACHE.stats(),
+    }
+
+
+def merge_cache_stats(stats):
+    """Sum the cache counters of several processes"""
+
+    merged = {}
+    for process_stats in stats:
+        for name, counters in process_stats.items():
+            total = merged.setdefault(name, {"hits": 0, "misses": 0, "nbytes": 0})
+            for key in total:
+                total[key] += counters[key]
+
+    for total in merged.values():
+        lookups = total["hits"] + total["misses"]
+        total["hit_rate"] = total["hits"] / lookups if lookups else 0.0
+
+    return merged
+
+
+# image writer of the current process
+_WRITER = None
+
+
+def _init_worker(frame_cache_bytes, factorization_cache_bytes, write_workers):
+    global _WRITER
+    FRAME_CACHE.max_bytes = frame_cache_bytes
+    FACTORIZATION_CACHE.max_bytes = factorization_cache_bytes
+    _WRITER = AsyncWriter(workers=write_workers)
+
+
+def _init_pool_worker(*args):
+    # one set per process already, and the OpenCV thread pool of a forked parent
+    # can deadlock
+    cv2.setNumThreads(1)
+    _init_worker(*args)
+
+
+def _make_set(kwargs):
+    make_one_set(writer=_WRITER, **kwargs)
+    return os.getpid(), cache_stats()
+
+
+def run_sets(
+    tasks,
+    workers=1,
+    frame_cache_bytes=0,
+    write_workers=4,
+    journal=None,
+    progress=True,
+    factorization_cache_bytes=256 * 1024**2,
+):
+    """Run make_one_set for every task, in a pool of worker processes when
+    workers > 1. Outputs only depend on the tasks, not on the worker count.
+
+    Args:
+        tasks (list): make_one_set keyword arguments of every set
+        workers (int, optional): number of worker processes. Defaults to 1.
+        frame_cache_bytes (int, optional): decoded frame cache budget, split
+            between the processes. Defaults to 0.
+        write_workers (int, optional): number of image writer threads of each
+            process. Defaults to 4.
+        journal (Journal, optional): records the completed sets. Defaults to None.
+        progress (bool, optional): display a progress bar. Defaults to True.
+        factorization_cache_bytes (int, optional): poisson factorization cache
+            budget, split between the processes. Defaults to 256MB.
+
+    Returns:
+        dict: cache counters summed over the processes
+    """
+
+    bar = tqdm(total=len(tasks), disable=not progress)
+    # the budgets bound the memory of the whole run
+    initargs = (
+        frame_cache_bytes // max(workers, 1),
+        factorization_cache_bytes // max(workers, 1),
+        write_workers,
+    )
+
+    if workers <= 1:
+        _init_worker(*initargs)
+        for kwargs in tasks:
+            _make_set(kwargs)
+            if journal is not None:
+                journal.add(kwargs)
+            bar.update()
+        _WRITER.close()
+        bar.close()
+        return merge_cache_stats([cache_stats()])
+
+    # last counters reported by each worker process
+    stats = {}
+    tasks = iter(tasks)
+    with ProcessPoolExecutor(
+        max_workers=workers,
+        initializer=_init_pool_worker,
+        initargs=initargs,
+    ) as executor:
+        # bounded number of queued sets
+        pending = {}
+        for kwargs in tasks:
+            pending[executor.submit(_make_set, kwargs)] = kwargs
+            if len(pending) >= 2 * workers:
+                break
+
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                pid, process_stats = future.result()
+                stats[pid] = process_stats
+                if journal is not None:
+                    journal.add(pending[future])
+                del pending[future]
+                bar.update()
+
+                kwargs = next(tasks, None)
+                if kwargs is not None:
+                    pending[executor.submit(_make_set, kwargs)] = kwargs
+
+    bar.close()
+
+    return merge_cache_stats(stats.values())
@@ -0,0 +1,100 @@
+# Copyright (C) 2019-2022, Pyronear.
+
+# This program is licensed under the Apache License version 2.
+# See LICENSE or go to <https://www.apache.org/licenses/LICENSE-2.0.txt> for full license details.
+
+import hashlib
+import os
+import numpy as np
+from functools import lru_cache
+
+
+@lru_cache(maxsize=None)
+def _digest(path, mtime_ns, size):
+    h = hashlib.sha1()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def file_digest(file):
+    """sha1 of the content of a file, computed once per process and version"""
+    st = os.stat(file)
+    return _digest(os.path.abspath(file), st.st_mtime_ns, st.st_size)
+
+
+def sky_cache_path(cache_dir, file, model_type, size_max):
+    """Path of the sky masks of a video, keyed by its content so that renamed
+    or copied videos share their masks"""
+    digest = file_digest(file)
+    return os.path.join(cache_dir, digest[:2], f"{digest}.{model_type}.{size_max}.npz")
+
+
+def write_sky_masks(cache_dir, file, model_type, size_max, masks):
+    """Write the sky masks of frames of a video, bit-packed and compressed
+
+    Args:
+        cache_dir (str): root folder of the cache
+        file (str): background video file
+        model_type (str): depth model the masks were estimated with
+        size_max (int): size of the largest side of the frames
+        masks (dict): boolean mask of the pixels that are not sky by frame index
+
+    Returns:
+        str: path of the masks
+    """
+
+    path = sky_cache_path(cache_dir, file, model_type, size_max)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    arrays = {f"{idx:06}": np.packbits(mask > 0) for idx, mask in masks.items()}
+    shape = next(iter(masks.values())).shape[:2] if masks else (0, 0)
+    with open(path + ".tmp", "wb") as f:
+        np.savez_compressed(f, shape=np.array(shape), **arrays)
+    os.replace(path + ".tmp", path)
+
+    return path
+
+
+@lru_cache(maxsize=None)
+def _stored_frames(path, mtime_ns, size):
+    with np.load(path) as masks:
+        return sorted(int(key) for key in masks.files if key != "shape")
+
+
+def stored_frame(cache_dir, file, frame_idx, model_type, size_max):
+    """Index of the stored frame whose sky mask is used for frame_idx, cameras
+    are static so it is the closest one at or before frame_idx
+
+    Returns:
+        int: stored frame index, None when the video is not in the cache
+    """
+
+    path = sky_cache_path(cache_dir, file, model_type, size_max)
+    if not os.path.isfile(path):
+        return None
+
+    st = os.stat(path)
+    idxs = _stored_frames(path, st.st_mtime_ns, st.st_size)
+    if not idxs:
+        return None
+    return max([i for i in idxs if i <= frame_idx], default=idxs[0])
+
+
+def read_sky_mask(cache_dir, file, frame_idx, model_type, size_max):
+    """Sky mask of a frame of a video, see stored_frame
+
+    Returns:
+        np.array: boolean mask of the pixels that are not sky, None when the
+        video is not in the cache
+    """
+
+    idx = stored_frame(cache_dir, file, frame_idx, model_type, size_max)
+    if idx is None:
+        return None
+
+    # members of the archive are only decompressed when read
+    with np.load(sky_cache_path(cache_dir, file, model_type, size_max)) as masks:
+        h, w = masks["shape"]
+        return np.unpackbits(masks[f"{idx:06}"], count=h * w).reshape(h, w) > 0
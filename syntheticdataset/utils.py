@@ -6,23 +6,184 @@
 import cv2
 import numpy as np
 import os
+from syntheticdataset.cache import LRUCache
+from syntheticdataset.frame_store import open_store, write_store
 
 
-def read_video(file, size_max=1280):
-    # Read smoke video
+def _frames_nbytes(frames):
+    return sum(frame.nbytes for frame in frames)
+
+
+# Decoded and resized frames shared across sets, disabled until given a budget
+FRAME_CACHE = LRUCache(0, sizeof=_frames_nbytes)
+
+
+def resize_frame(frame, size_max=1280):
+    r = size_max / max(frame.shape)
+    h, w = frame.shape[:2]
+    return cv2.resize(frame, (int(w * r), int(h * r)))
+
+
+def iter_video(file, size_max=1280, start=0, stride=1, max_frames=None):
+    """Lazily read the frames start, start + stride, ... of a video
+
+    Skipped frames are grabbed without being decoded nor resized
+
+    Args:
+        file (str): video file
+        size_max (int, optional): size of the largest side of the resized frames.
+            Defaults to 1280.
+        start (int, optional): index of the first frame. Defaults to 0.
+        stride (int, optional): step between two frames. Defaults to 1.
+        max_frames (int, optional): maximum number of frames. Defaults to None.
+
+    Yields:
+        np.array: resized frame
+    """
+
     cap = cv2.VideoCapture(file)
-    imgs = []
-    ret = True
-    while cap.isOpened() and ret:
-        # Capture frame-by-frame
-        ret, frame = cap.read()
-        if ret:
-            r = size_max / max(frame.shape)
-            h, w = frame.shape[:2]
-            frame = cv2.resize(frame, (int(w * r), int(h * r)))
-            imgs.append(frame)
+    try:
+        # seek when the backend supports it, grab otherwise
+        if start > 0 and not (
+            cap.set(cv2.CAP_PROP_POS_FRAMES, start)
+            and int(cap.get(cv2.CAP_PROP_POS_FRAMES)) == start
+        ):
+            cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
+            for _ in range(start):
+                if not cap.grab():
+                    return
+
+        n = 0
+        while cap.isOpened() and (max_frames is None or n < max_frames):
+            # Capture frame-by-frame
+            ret, frame = cap.read()
+            if not ret:
+                return
+
+            yield resize_frame(frame, size_max)
+            n += 1
+
+            for _ in range(stride - 1):
+                if not cap.grab():
+                    return
+    finally:
+        cap.release()
+
+
+def get_video_length(file):
+    """Number of frames of a video as reported by its container"""
+    cap = cv2.VideoCapture(file)
+    n = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+    cap.release()
+
+    return n
+
+
+def get_video_size(file):
+    """Height and width of the frames of a video"""
+    cap = cv2.VideoCapture(file)
+    h = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+    w = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+    cap.release()
+
+    return h, w
+
+
+def select_keyframes(frames, threshold=8.0, max_interval=25, width=64):
+    """Frames starting a new scene: the mean absolute difference of their
+    downscaled grayscale version with the last keyframe exceeds threshold, or
+    max_interval frames passed since it
+
+    Args:
+        frames (list): BGR frames of a video
+        threshold (float, optional): mean absolute difference, in grey levels,
+            triggering a keyframe. Defaults to 8.0.
+        max_interval (int, optional): maximum number of frames between two
+            keyframes. Defaults to 25.
+        width (int, optional): width of the compared frames. Defaults to 64.
+
+    Returns:
+        list: indexes of the keyframes, the first frame is always one
+    """
 
-    return imgs
+    keyframes = []
+    reference = None
+    for i, frame in enumerate(frames):
+        h, w = frame.shape[:2]
+        small = cv2.resize(
+            cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY),
+            (width, max(1, h * width // w)),
+            interpolation=cv2.INTER_AREA,
+        ).astype(np.float32)
+
+        if (
+            reference is None
+            or i - keyframes[-1] >= max_interval
+            or np.abs(small - reference).mean() > threshold
+        ):
+            keyframes.append(i)
+            reference = small
+
+    return keyframes
+
+
+def read_video(
+    file, size_max=1280, start=0, stride=1, max_frames=None, cache=FRAME_CACHE
+):
+    """Read the frames start, start + stride, ... of a video through cache
+
+    Cached frames are read-only and keyed by (path, mtime, size_max, stride,
+    start, max_frames)
+    """
+
+    if cache is None or cache.max_bytes == 0:
+        return list(iter_video(file, size_max, start, stride, max_frames))
+
+    key = (
+        os.path.abspath(file),
+        os.stat(file).st_mtime_ns,
+        size_max,
+        stride,
+        start,
+        max_frames,
+    )
+    imgs = cache.get(key)
+    if imgs is None:
+        imgs = list(iter_video(file, size_max, start, stride, max_frames))
+        for img in imgs:
+            img.setflags(write=False)
+        cache.put(key, imgs)
+
+    return list(imgs)
+
+
+def export_video(file, store_dir, size_max=1280):
+    """Decode and resize a video once into the memory mapped frame store"""
+    return write_store(store_dir, file, size_max, iter_video(file, size_max))
+
+
+def video_frames(
+    file,
+    size_max=1280,
+    start=0,
+    stride=1,
+    max_frames=None,
+    cache=FRAME_CACHE,
+    store=None,
+):
+    """Iterate over the frames of a video: zero-copy views of the frame store
+    when the video was exported to store, through cache when it is enabled,
+    lazily decoding them otherwise (see iter_video)"""
+
+    if store is not None:
+        imgs = open_store(store, file, size_max)
+        if imgs is not None:
+            return iter(imgs[start::stride][:max_frames])
+
+    if cache is None or cache.max_bytes == 0:
+        return iter_video(file, size_max, start, stride, max_frames)
+
+    return iter(read_video(file, size_max, start, stride, max_frames, cache=cache))
 
 
 def save_img(folder_path, filename, img):
@@ -36,18 +197,48 @@ def save_label(folder_path, filename, label):
         f.write(label)
 
 
-def get_label(mask):
-    """Compute bounding box"""
-    if np.sum(mask > 0) > 100:  # set minimum size (10x10 pixel on average)
-        y0, x0 = np.min(np.where(mask), 1)
-        y1, x1 = np.max(np.where(mask), 1)
-        h, w = mask.shape
-        dw = (x1 - x0) / w
-        dh = (y1 - y0) / h
-        xc = x0 / w + dw / 2
-        yc = y0 / h + dh / 2
-        label = str(1) + " " + str(xc) + " " + str(yc) + " " + str(dw) + " " + str(dh)
-    else:
-        label = ""
-
-    return label
+def get_bboxes(masks, offset=(0, 0), shape=None):
+    """Compute bounding boxes of a stack of masks, as get_label
+
+    Args:
+        masks (np.array): masks of shape (N, h, w)
+        offset (tuple, optional): offset (dy, dx) of the masks in the frames.
+            Defaults to (0, 0).
+        shape (tuple, optional): height and width of the frames, the ones of the
+            masks if None. Defaults to None.
+
+    Returns:
+        np.array: boxes (xc, yc, w, h) relative to the frames, of shape (N, 4), NaN
+            for masks below the minimum size
+    """
+    masks = masks > 0
+    _, hm, wm = masks.shape
+    rows = masks.any(axis=2)
+    cols = masks.any(axis=1)
+    y0 = rows.argmax(axis=1) + offset[0]
+    y1 = hm - 1 - rows[:, ::-1].argmax(axis=1) + offset[0]
+    x0 = cols.argmax(axis=1) + offset[1]
+    x1 = wm - 1 - cols[:, ::-1].argmax(axis=1) + offset[1]
+
+    h, w = (hm, wm) if shape is None else shape
+    dw = (x1 - x0) / w
+    dh = (y1 - y0) / h
+    bboxes = np.stack([x0 / w + dw / 2, y0 / h + dh / 2, dw, dh], axis=1)
+    # set minimum size (10x10 pixel on average)
+    bboxes[masks.sum(axis=(1, 2)) <= 100] = np.nan
+
+    return bboxes
+
+
+def bbox_label(bbox):
+    """Label line of a box of get_bboxes, empty without box"""
+    if np.isnan(bbox).any():
+        return ""
+
+    return " ".join([str(1)] + [str(v) for v in bbox])
+
+
+def get_label(mask, offset=(0, 0), shape=None):
+    """Compute bounding box, of a ROI mask at offset in a frame of the given
+    shape when shape is not None"""
+    return bbox_label(get_bboxes(mask[None], offset, shape)[0])
@@ -0,0 +1,281 @@
+# Copyright (C) 2019-2022, Pyronear.
+
+# This program is licensed under the Apache License version 2.
+# See LICENSE or go to <https://www.apache.org/licenses/LICENSE-2.0.txt> for full license details.
+
+import cv2
+import glob
+import io
+import json
+import os
+import tarfile
+import threading
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+
+
+# cv2 flag of the level option of each image format
+LEVEL_FLAGS = {
+    "png": cv2.IMWRITE_PNG_COMPRESSION,
+    "jpg": cv2.IMWRITE_JPEG_QUALITY,
+    "webp": cv2.IMWRITE_WEBP_QUALITY,
+}
+
+
+def temp_path(path):
+    """Temporary file of path, hidden in the same folder to be skipped by the
+    globs of the dataset folders"""
+    folder_path, name = os.path.split(path)
+    return os.path.join(folder_path, f".{name}.tmp")
+
+
+def remove_temp_files(folder_path, pattern="*"):
+    """Remove the temporary files of the interrupted writes to the files of
+    folder_path matching pattern"""
+    for path in glob.glob(os.path.join(folder_path, f".{pattern}.tmp")):
+        os.remove(path)
+
+
+def atomic_write(path, data):
+    """Write bytes to a temporary file renamed to path, an interrupted write
+    never leaves a partial file at path"""
+    with open(temp_path(path), "wb") as f:
+        f.write(data)
+    os.replace(temp_path(path), path)
+
+
+def encode_params(ext, level=None):
+    """cv2 encoding parameters of an image format
+
+    Args:
+        ext (str): image format, png, jpg or webp
+        level (int, optional): PNG compression level (0-9) or JPEG/WebP quality
+            (0-100), None for the cv2 default. Defaults to None.
+
+    Returns:
+        list: cv2.imwrite / cv2.imencode parameters
+    """
+    if ext not in LEVEL_FLAGS:
+        raise ValueError(
+            f"Unknown image format {ext}, expected one of {list(LEVEL_FLAGS)}"
+        )
+    return [] if level is None else [LEVEL_FLAGS[ext], int(level)]
+
+
+def encode_sample(files, params=None):
+    """Encode the files of a sample, arrays with the last suffix of their
+    extension as image format and text as utf-8
+
+    Args:
+        files (dict): file content by extension
+        params (dict, optional): cv2 encoding parameters by extension. Defaults to None.
+
+    Returns:
+        dict: encoded bytes by extension
+    """
+    params = params or {}
+    encoded = {}
+    for ext, data in files.items():
+        if isinstance(data, str):
+            encoded[ext] = data.encode()
+        else:
+            ok, buf = cv2.imencode("." + ext.split(".")[-1], data, params.get(ext, []))
+            if not ok:
+                raise IOError(f"Could not encode {ext} image")
+            encoded[ext] = buf.tobytes()
+    return encoded
+
+
+class AsyncWriter:
+    """Write images and labels from a pool of threads, cv2 releases the GIL while
+    encoding. At most max_pending jobs are queued, submitting blocks beyond that.
+    Arrays must not be modified once submitted.
+
+    Args:
+        workers (int, optional): number of writer threads. Defaults to 4.
+        max_pending (int, optional): maximum number of queued jobs. Defaults to 16.
+    """
+
+    def __init__(self, workers=4, max_pending=16):
+        self.workers = workers
+        self._executor = None
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._lock = threading.Lock()
+        self._folders = set()
+        self._futures = []
+
+    def _makedirs(self, folder_path):
+        with self._lock:
+            if folder_path in self._folders:
+                return
+            self._folders.add(folder_path)
+        os.makedirs(folder_path, exist_ok=True)
+
+    @staticmethod
+    def _write_img(path, img, params):
+        ok, buf = cv2.imencode(os.path.splitext(path)[1], img, params)
+        if not ok:
+            raise IOError(f"Could not write {path}")
+        atomic_write(path, buf.tobytes())
+
+    @staticmethod
+    def _write_label(path, label):
+        atomic_write(path, label.encode())
+
+    def submit(self, fn, *args):
+        """Run fn(*args) in the pool, blocks while max_pending jobs are queued
+
+        Returns:
+            Future: result of the job
+        """
+        if self.workers <= 0:
+            future = Future()
+            try:
+                future.set_result(fn(*args))
+            except Exception as e:
+                future.set_exception(e)
+        else:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.workers)
+            # backpressure
+            self._slots.acquire()
+            future = self._executor.submit(fn, *args)
+            future.add_done_callback(lambda _: self._slots.release())
+
+        self._futures.append(future)
+        return future
+
+    def save_img(self, folder_path, filename, img, params=()):
+        self._makedirs(folder_path)
+        self.submit(self._write_img, f"{folder_path}/{filename}", img, list(params))
+
+    def save_label(self, folder_path, filename, label):
+        self._makedirs(folder_path)
+        self.submit(self._write_label, f"{folder_path}/{filename}", label)
+
+    def flush(self):
+        """Wait for the queued jobs and raise the first error"""
+        futures, self._futures = self._futures, []
+        errors = [future.exception() for future in futures]
+        for error in errors:
+            if error is not None:
+                raise error
+
+    def close(self):
+        try:
+            self.flush()
+        finally:
+            if self._executor is not None:
+                self._executor.shutdown()
+                self._executor = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class ShardWriter:
+    """Write samples into tar shards of at most maxcount samples, webdataset
+    style: the files of a sample share its key and differ by their extension.
+    Samples are encoded by the writer pool and appended in submission order.
+
+    Args:
+        pattern (str): shard path pattern, formatted with the shard number
+        writer (AsyncWriter): pool encoding the samples
+        maxcount (int, optional): maximum samples per shard. Defaults to 1000.
+        params (dict, optional): cv2 encoding parameters by extension. Defaults to None.
+    """
+
+    def __init__(self, pattern, writer, maxcount=1000, params=None):
+        self.pattern = pattern
+        self.writer = writer
+        self.maxcount = maxcount
+        self.params = params or {}
+        self.shards = []
+        self._tar = None
+        self._count = 0
+        self._pending = deque()
+
+    def _close_shard(self):
+        # shards are renamed once complete
+        self._tar.close()
+        os.replace(self._tar.name, self.shards[-1]["url"])
+        self._tar = None
+
+    def _next_shard(self):
+        if self._tar is not None:
+            self._close_shard()
+        path = self.pattern.format(len(self.shards))
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._tar = tarfile.open(temp_path(path), "w")
+        self._count = 0
+        self.shards.append({"url": path, "nsamples": 0})
+
+    def _write(self, key, encoded):
+        if self._tar is None or self._count >= self.maxcount:
+            self._next_shard()
+        for ext, data in encoded.items():
+            info = tarfile.TarInfo(f"{key}.{ext}")
+            info.size = len(data)
+            self._tar.addfile(info, io.BytesIO(data))
+        self._count += 1
+        self.shards[-1]["nsamples"] += 1
+
+    def _drain(self, block):
+        while self._pending and (block or self._pending[0][1].done()):
+            key, future = self._pending.popleft()
+            self._write(key, future.result())
+
+    def save_sample(self, key, files):
+        """Queue a sample, arrays must not be modified once submitted
+
+        Args:
+            key (str): sample key, the file names without extension
+            files (dict): file content by extension, images as arrays and labels as str
+        """
+        self._pending.append(
+            (key, self.writer.submit(encode_sample, files, self.params))
+        )
+        self._drain(block=False)
+
+    def close(self):
+        """Write the queued samples and close the last shard
+
+        Returns:
+            list: url and number of samples of every shard
+        """
+        self._drain(block=True)
+        if self._tar is not None:
+            self._close_shard()
+        return self.shards
+
+
+def write_shard_index(folder_path):
+    """Write the index.json of a folder of tar shards, in the wids shard index
+    format, from the tar headers
+
+    Args:
+        folder_path (str): shard folder
+
+    Returns:
+        dict: the index
+    """
+    shardlist = []
+    for name in sorted(os.listdir(folder_path)):
+        if name.endswith(".tar"):
+            with tarfile.open(os.path.join(folder_path, name)) as tar:
+                keys = {member.name.split(".")[0] for member in tar}
+            shardlist.append({"url": name, "nsamples": len(keys)})
+
+    index = {
+        "__kind__": "wids-shard-index-v1",
+        "wids_version": 1,
+        "shardlist": shardlist,
+    }
+    atomic_write(
+        os.path.join(folder_path, "index.json"), json.dumps(index, indent=2).encode()
+    )
+
+    return index
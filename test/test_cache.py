@@ -0,0 +1,31 @@
+# Copyright (C) 2019-2022, Pyronear.
+
+# This program is licensed under the Apache License version 2.
+# See LICENSE or go to <https://www.apache.org/licenses/LICENSE-2.0.txt> for full license details.
+
+import unittest
+from syntheticdataset.cache import LRUCache
+
+
+class LRUCacheTester(unittest.TestCase):
+    def test_eviction(self):
+        cache = LRUCache(10, sizeof=len)
+
+        self.assertTrue(cache.put("a", "aaaa"))
+        self.assertTrue(cache.put("b", "bbbb"))
+        self.assertEqual(cache.get("a"), "aaaa")
+        self.assertTrue(cache.put("c", "cccc"))
+
+        # "b" is the least recently used entry
+        self.assertNotIn("b", cache)
+        self.assertIn("a", cache)
+        self.assertEqual(cache.nbytes, 8)
+
+        self.assertFalse(cache.put("d", "d" * 11))
+        self.assertIsNone(cache.get("d"))
+        self.assertEqual(cache.stats()["hits"], 1)
+        self.assertEqual(cache.stats()["misses"], 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,179 @@
+# Copyright (C) 2019-2022, Pyronear.
+
+# This program is licensed under the Apache License version 2.
+# See LICENSE or go to <https://www.apache.org/licenses/LICENSE-2.0.txt> for full license details.
+
+import numpy as np
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+try:
+    import torch
+    from syntheticdataset.randomization import depth_estimation
+    from syntheticdataset.randomization.depth_estimation import (
+        MIDAS_HYBRID,
+        MIDAS_LARGE,
+        MIDAS_SMALL,
+        DepthEstimation,
+        export_model,
+        load_exported_model,
+        midas_transform,
+    )
+except ImportError:
+    torch = None
+
+
+if torch is not None:
+
+    class TinyDepth(torch.nn.Module):
+        """MiDaS like model mapping a (B, 3, H, W) batch to a (B, H, W) depth,
+        its input shapes are recorded"""
+
+        def __init__(self):
+            super().__init__()
+            self.calls = []
+
+        def forward(self, x):
+            self.calls.append(tuple(x.shape))
+            return 15 + x.mean(1)
+
+
+def make_depth(**kwargs):
+    model = TinyDepth()
+    with mock.patch.object(depth_estimation, "load_model", return_value=model):
+        depth = DepthEstimation(MIDAS_SMALL, **kwargs)
+    return depth, model
+
+
+def make_frames(values, shape=(48, 80)):
+    return [np.full(shape + (3,), value, dtype=np.uint8) for value in values]
+
+
+@unittest.skipUnless(torch, "torch is not installed")
+class DepthEstimationTester(unittest.TestCase):
+    def test_batch(self):
+        frames = make_frames([0, 60, 120, 180, 240])
+
+        for batch_size, n_batches in [(1, 5), (3, 2)]:
+            depth, model = make_depth()
+            depths = depth.estimate_depth_from_batch(frames, batch_size)
+
+            # one depth per frame at the size of the frame
+            self.assertEqual(len(depths), len(frames))
+            for d in depths:
+                self.assertEqual(d.shape, frames[0].shape[:2])
+            self.assertEqual(len(model.calls), n_batches)
+            self.assertEqual(model.calls[0], (batch_size, 3, 160, 256))
+
+            stats = depth.stats()
+            self.assertEqual(stats["frames"], len(frames))
+            self.assertEqual(stats["batches"], n_batches)
+            self.assertGreater(stats["frames_per_s"], 0)
+            self.assertGreater(stats["ms_per_batch"], 0)
+
+        # frames are batched alone as in a batch
+        self.assertEqual(
+            depth.estimate_depth_from_image(frames[1]).tolist(), depths[1].tolist()
+        )
+
+        depth.reset_stats()
+        self.assertEqual(depth.stats()["frames"], 0)
+        self.assertEqual(depth.stats()["frames_per_s"], 0.0)
+
+    def test_input_size(self):
+        depth, model = make_depth(input_size=64)
+        depths = depth.estimate_depth_from_batch(make_frames([0, 120, 240]), 2)
+
+        # the network input is reduced, the depth keeps the size of the frames
+        self.assertEqual(model.calls, [(2, 3, 64, 96), (1, 3, 64, 96)])
+        self.assertEqual([d.shape for d in depths], [(48, 80)] * 3)
+
+    def test_sequence(self):
+        # the camera sees another scene from the sixth frame
+        frames = make_frames([0] * 5 + [240] * 5)
+
+        depth, model = make_depth()
+        depths = depth.estimate_depth_from_sequence(frames, interpolate=True)
+
+        # a single forward pass for the two keyframes
+        self.assertEqual(model.calls, [(2, 3, 160, 256)])
+        self.assertEqual(depth.stats()["frames"], 2)
+        self.assertEqual(depth.stats()["saved"], 8)
+        self.assertEqual(len(depths), len(frames))
+
+        # frames between the keyframes are interpolated, the last ones reuse the
+        # depth of the last keyframe
+        self.assertLess(depths[0].mean(), depths[5].mean())
+        for previous, d in zip(depths[:4], depths[1:5]):
+            self.assertLess(previous.mean(), d.mean())
+            self.assertTrue((depths[0] <= d).all() and (d <= depths[5]).all())
+        for d in depths[6:]:
+            self.assertIs(d, depths[5])
+
+        depths = depth.estimate_depth_from_sequence(frames)
+        self.assertEqual(len(model.calls), 2)
+        for d in depths[1:5]:
+            self.assertIs(d, depths[0])
+
+    def test_sky_sequence(self):
+        depth, model = make_depth()
+        masks = depth.detect_sky_from_sequence(make_frames([120] * 6))
+
+        self.assertEqual(len(model.calls), 1)
+        self.assertEqual(depth.stats()["saved"], 5)
+        # the shared depth is thresholded once, a second time would zero it
+        for mask in masks:
+            self.assertIs(mask, masks[0])
+        self.assertTrue((masks[0] == 255).all())
+
+    def test_transform(self):
+        rgb = np.array([51, 102, 204], dtype=np.uint8)
+        # Resize and NormalizeImage settings of the transforms of the MiDaS hub:
+        # DPT models keep the sides at least 384 ("minimal"), MiDaS small at most
+        # 256 ("upper_bound"), both multiples of 32
+        dpt = (np.array([0.5] * 3), np.array([0.5] * 3))
+        small = (np.array([0.485, 0.456, 0.406]), np.array([0.229, 0.224, 0.225]))
+        cases = [
+            (MIDAS_LARGE, (720, 1280), (384, 672), dpt),
+            (MIDAS_HYBRID, (480, 640), (384, 512), dpt),
+            (MIDAS_SMALL, (720, 1280), (128, 256), small),
+            (MIDAS_SMALL, (480, 640), (192, 256), small),
+        ]
+        for model_type, shape, input_shape, (mean, std) in cases:
+            img = np.broadcast_to(rgb, shape + (3,)).copy()
+            input = midas_transform(model_type)(img)
+
+            self.assertEqual(tuple(input.shape), (1, 3) + input_shape)
+            self.assertEqual(input.dtype, torch.float32)
+            np.testing.assert_allclose(
+                input[0].mean(dim=(1, 2)).numpy(), (rgb / 255 - mean) / std, atol=1e-4
+            )
+
+    def test_export(self):
+        model = TinyDepth()
+        with tempfile.TemporaryDirectory() as folder:
+            path = os.path.join(folder, "midas_small.pt")
+            with mock.patch.object(depth_estimation, "load_model", return_value=model):
+                config = export_model(path, MIDAS_SMALL, input_shape=(64, 96))
+
+            exported, loaded = load_exported_model(path)
+            self.assertEqual(loaded, config)
+            self.assertEqual(loaded["input_shape"], [64, 96])
+
+            # the traced model computes the depth of the model, for any batch size
+            input = torch.rand(2, 3, 64, 96)
+            with torch.no_grad():
+                self.assertTrue(torch.allclose(exported(input), model(input)))
+
+            # the exported model sets the model type and the network input
+            depth = DepthEstimation(model_path=path)
+            self.assertEqual(depth.model_type, MIDAS_SMALL)
+            self.assertEqual(depth.input_shape, (64, 96))
+            depths = depth.estimate_depth_from_batch(make_frames([0, 240]))
+            self.assertEqual([d.shape for d in depths], [(48, 80)] * 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,109 @@
+# Copyright (C) 2019-2022, Pyronear.
+
+# This program is licensed under the Apache License version 2.
+# See LICENSE or go to <https://www.apache.org/licenses/LICENSE-2.0.txt> for full license details.
+
+import cv2
+import numpy as np
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from syntheticdataset.image_blending import (
+    BasicBlender,
+    basic_blending,
+    blend_clip,
+    poisson_blending,
+    _basic_blending_reference,
+)
+from syntheticdataset.utils import bbox_label, get_label, iter_video
+
+
+class BasicBlendingTester(unittest.TestCase):
+    def test_basic_blending(self):
+        img = next(iter_video("test/videos/test_bg.mp4"))
+        offset = (100, 200)
+        for smoke in iter_video("test/videos/test_smoke.mp4", stride=30):
+            smoke = cv2.resize(smoke, (0, 0), fx=0.3, fy=0.3)
+
+            ref, ref_mask = _basic_blending_reference(img.copy(), smoke, offset, 0.6)
+            res, mask = basic_blending(img.copy(), smoke, offset, 0.6)
+            # float32 rounding only
+            self.assertLessEqual(np.abs(res.astype(int) - ref).max(), 1)
+            np.testing.assert_array_equal(mask, ref_mask)
+
+            _, roi = basic_blending(img.copy(), smoke, offset, 0.6, roi_mask=True)
+            self.assertEqual(roi.shape, smoke.shape[:2])
+            self.assertEqual(
+                get_label(roi * 255, offset, img.shape[:2]), get_label(mask * 255)
+            )
+
+    def test_buffers(self):
+        blender = BasicBlender()
+        img = np.zeros((64, 64, 3), np.uint8)
+        smoke = np.full((16, 16, 3), 200, np.uint8)
+
+        _, mask = blender.blend(img, smoke, (10, 20))
+        _, other = blender.blend(img, smoke, (30, 20))
+        # the buffers of a smoke size are reused
+        self.assertIs(mask, other)
+        self.assertTrue(img[30:46, 20:36].any())
+        self.assertFalse(img[:10].any())
+
+        # every thread blends on its own buffers
+        smokes = [np.full((16, 16, 3), v, np.uint8) for v in range(60, 250, 10)]
+
+        def blend(smoke):
+            return basic_blending(np.zeros_like(img), smoke, (10, 20), roi_mask=True)
+
+        expected = [blend(smoke) for smoke in smokes]
+        with ThreadPoolExecutor(4) as executor:
+            for _ in range(20):
+                results = executor.map(blend, smokes)
+                for (res, mask), (ref, ref_mask) in zip(results, expected):
+                    np.testing.assert_array_equal(res, ref)
+                    np.testing.assert_array_equal(mask, ref_mask)
+
+    def test_blend_clip(self):
+        bgs = np.stack(
+            [frame for frame, _ in zip(iter_video("test/videos/test_bg.mp4"), range(5))]
+        )
+        smokes = np.stack(
+            [
+                cv2.resize(smoke, (0, 0), fx=0.3, fy=0.3)
+                for smoke in iter_video("test/videos/test_smoke.mp4", stride=30)
+            ][:5]
+        )
+        offset = (100, 200)
+
+        results, masks, bboxes = blend_clip(bgs, smokes, offset, 0.6, chunk_size=2)
+        self.assertEqual(results.shape, bgs.shape)
+        self.assertEqual(masks.shape, bgs.shape[:3])
+        self.assertEqual(bboxes.shape, (5, 4))
+        for bg, smoke, res, mask, bbox in zip(bgs, smokes, results, masks, bboxes):
+            # chunks blend as basic_blending frame by frame
+            expected, expected_mask = basic_blending(bg.copy(), smoke, offset, 0.6)
+            np.testing.assert_array_equal(res, expected)
+            np.testing.assert_array_equal(mask, expected_mask)
+            self.assertEqual(bbox_label(bbox), get_label(expected_mask * 255))
+
+        _, roi, _ = blend_clip(bgs, smokes, offset, roi_mask=True)
+        self.assertEqual(roi.shape, smokes.shape[:3])
+
+        results, masks, bboxes = blend_clip(
+            bgs[:2],
+            smokes[:2],
+            offset,
+            method="poisson",
+            poisson_options={"method": "fast"},
+        )
+        expected, expected_mask = poisson_blending(
+            bgs[0].copy(), smokes[0], offset, method="fast"
+        )
+        np.testing.assert_array_equal(results[0], expected)
+        np.testing.assert_array_equal(masks[0], expected_mask)
+
+        with self.assertRaises(ValueError):
+            blend_clip(bgs, smokes, offset, method="unknown")
+
+
+if __name__ == "__main__":
+    unittest.main()
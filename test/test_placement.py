@@ -0,0 +1,44 @@
+# Copyright (C) 2019-2022, Pyronear.
+
+# This program is licensed under the Apache License version 2.
+# See LICENSE or go to <https://www.apache.org/licenses/LICENSE-2.0.txt> for full license details.
+
+import numpy as np
+import random
+import unittest
+from syntheticdataset.placement import Placement, valid_mask
+
+
+class PlacementTester(unittest.TestCase):
+    def test_overlap(self):
+        valid = np.random.RandomState(0).rand(30, 40) > 0.5
+        hs, ws = 7, 5
+        fraction = Placement(valid).overlap((hs, ws))
+
+        self.assertEqual(fraction.shape, (30 - hs, 40 - ws))
+        for dy, dx in [(0, 0), (3, 17), (22, 34)]:
+            self.assertAlmostEqual(
+                fraction[dy, dx], valid[dy : dy + hs, dx : dx + ws].mean()
+            )
+
+    def test_sample(self):
+        # the top half is sky and the right quarter is excluded
+        ground = np.zeros((60, 80), dtype=bool)
+        ground[30:] = True
+        valid = valid_mask(ground.shape, ground, exclusion_zones=[(0, 0.75, 1, 1)])
+        self.assertFalse(valid[50, 70])
+        self.assertTrue(valid[50, 10])
+
+        placement = Placement(valid)
+        rng = random.Random(0)
+        for _ in range(20):
+            dy, dx = placement.sample(rng, (10, 8), min_fraction=0.5)
+            self.assertGreaterEqual(valid[dy : dy + 10, dx : dx + 8].mean(), 0.5)
+
+        # without valid offsets, the most valid one is used: dy < 60 - 50
+        dy, dx = placement.sample(rng, (50, 8), min_fraction=1.0)
+        self.assertAlmostEqual(valid[dy : dy + 50, dx : dx + 8].mean(), 29 / 50)
+
+
+if __name__ == "__main__":
+    unittest.main()
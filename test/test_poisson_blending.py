@@ -0,0 +1,180 @@
+# Copyright (C) 2019-2022, Pyronear.
+
+# This program is licensed under the Apache License version 2.
+# See LICENSE or go to <https://www.apache.org/licenses/LICENSE-2.0.txt> for full license details.
+
+import unittest
+import numpy as np
+from syntheticdataset.cache import LRUCache
+from syntheticdataset.image_blending import poisson_blending
+from syntheticdataset.poisson_blending_utils import (
+    build_poisson_system,
+    create_mask,
+    get_mixed_gradient_field,
+    get_mixed_gradient_sum,
+    poisson_blend,
+    poisson_blend_pyramid,
+    _factorization_nbytes,
+)
+from syntheticdataset.poisson_solvers import conjugate_gradient
+
+
+def make_inputs(hs=24, ws=30, seed=0):
+    rng = np.random.RandomState(seed)
+    img = rng.randint(0, 256, (60, 80, 3)).astype(np.uint8)
+    smoke = rng.randint(0, 256, (hs, ws, 3)).astype(np.uint8)
+    smoke_mask = smoke[:, :, 0] > 50
+
+    return create_mask(smoke_mask, img, smoke, offset=(10, 20)) + (
+        img.astype(np.float64),
+    )
+
+
+class PoissonBlendingTester(unittest.TestCase):
+    def test_vectorized_assembly(self):
+        mask, src, offset_adj, img = make_inputs()
+
+        for method in ["normal", "mix", "src", "target"]:
+            ref = poisson_blend(
+                mask, src, img, method=method, offset_adj=offset_adj, assembly="loop"
+            )
+            res = poisson_blend(mask, src, img, method=method, offset_adj=offset_adj)
+            np.testing.assert_array_equal(res, ref)
+
+    def test_mixed_gradient_field(self):
+        mask, src, offset_adj, img = make_inputs()
+        hm, wm = mask.shape
+        target = img[
+            offset_adj[0] : offset_adj[0] + hm, offset_adj[1] : offset_adj[1] + wm
+        ]
+
+        for c in [0.5, 2.0]:
+            field = get_mixed_gradient_field(src, target, c=c)
+            for i, j in zip(*np.nonzero(mask)):
+                np.testing.assert_array_equal(
+                    field[i, j],
+                    get_mixed_gradient_sum(src, img, i, j, hm, wm, offset_adj, c=c),
+                )
+
+    def test_mask_domain(self):
+        mask, src, offset_adj, img = make_inputs()
+
+        for method in ["normal", "mix", "src", "target"]:
+            ref = poisson_blend(mask, src, img, method=method, offset_adj=offset_adj)
+            res = poisson_blend(
+                mask, src, img, method=method, offset_adj=offset_adj, domain="mask"
+            )
+            np.testing.assert_allclose(res, ref, atol=1)
+
+    def test_factorization_cache(self):
+        mask, src, offset_adj, img = make_inputs()
+        cache = LRUCache(64 * 1024**2, sizeof=_factorization_nbytes)
+
+        ref = poisson_blend(mask, src, img, method="normal", offset_adj=offset_adj)
+        for _ in range(2):
+            res = poisson_blend(
+                mask, src, img, method="normal", offset_adj=offset_adj, cache=cache
+            )
+            np.testing.assert_allclose(res, ref, atol=1)
+
+        self.assertEqual(cache.misses, 1)
+        self.assertEqual(cache.hits, 1)
+
+    def test_iterative_solvers(self):
+        mask, src, offset_adj, img = make_inputs()
+        ref = poisson_blend(mask, src, img, method="normal", offset_adj=offset_adj)
+
+        for solver in ["cg", "multigrid"]:
+            res = poisson_blend(
+                mask,
+                src,
+                img,
+                method="normal",
+                offset_adj=offset_adj,
+                solver=solver,
+                tol=1e-8,
+            )
+            np.testing.assert_allclose(res, ref, atol=1)
+
+        # warm start from the solution
+        A, F, _ = build_poisson_system(
+            mask, src, img, method="normal", offset_adj=offset_adj, domain="mask"
+        )
+        x, it = conjugate_gradient(A, F, tol=1e-8)
+        self.assertGreater(it, 0)
+        _, it = conjugate_gradient(A, F, x0=x, tol=1e-6)
+        self.assertEqual(it, 0)
+
+    def test_fast_solver(self):
+        mask, src, offset_adj, img = make_inputs()
+
+        # without smoke the target gradient field gives back the target
+        res = poisson_blend(
+            np.zeros_like(mask), src, img, method="fast", offset_adj=offset_adj
+        )
+        np.testing.assert_allclose(res, img, atol=1)
+
+        res = poisson_blend(mask, src, img, method="fast", offset_adj=offset_adj)
+        hm, wm = mask.shape
+        np.testing.assert_array_equal(res[: offset_adj[0]], img[: offset_adj[0]])
+        self.assertFalse(
+            np.array_equal(
+                res[offset_adj[0] : offset_adj[0] + hm],
+                img[offset_adj[0] : offset_adj[0] + hm],
+            )
+        )
+
+        # with the whole interior of the ROI masked, the DST solve is the sparse
+        # solve of method "normal"
+        interior = np.zeros_like(mask)
+        interior[1:-1, 1:-1] = 1
+        np.testing.assert_array_equal(
+            poisson_blend(interior, src, img, method="fast", offset_adj=offset_adj),
+            poisson_blend(interior, src, img, method="normal", offset_adj=offset_adj),
+        )
+
+    def test_pyramid(self):
+        mask, src, offset_adj, img = make_inputs(48, 60)
+        ref = poisson_blend(mask, src, img, method="normal", offset_adj=offset_adj)
+
+        errors = []
+        for refine_iters in [0, 200]:
+            res = poisson_blend_pyramid(
+                mask,
+                src,
+                img,
+                offset_adj=offset_adj,
+                levels=1,
+                refine_iters=refine_iters,
+            )
+            self.assertEqual(res.shape, img.shape)
+            errors.append(np.abs(res.astype(int) - ref).mean())
+
+        # refinement converges to the exact solve
+        self.assertLess(errors[1], errors[0])
+        self.assertLess(errors[1], 0.5)
+
+    def test_poisson_blending_roi(self):
+        rng = np.random.RandomState(0)
+        img = rng.randint(0, 256, (72, 128, 3)).astype(np.uint8)
+        smoke = rng.randint(0, 256, (30, 40, 3)).astype(np.uint8)
+
+        mask, src, offset_adj = create_mask(smoke[:, :, 0] > 50, img, smoke, (5, 7))
+        ref = poisson_blend(mask, src, img, method="normal", offset_adj=offset_adj)
+
+        # the region under the smoke is blended in place
+        work = img.copy()
+        res, res_mask = poisson_blending(work, smoke, offset=(5, 7))
+        self.assertIs(res, work)
+        np.testing.assert_array_equal(res, ref)
+        self.assertEqual(res_mask.shape, img.shape[:2])
+
+        # the mask of the smoke ROI only is the full frame one at offset
+        _, roi = poisson_blending(img.copy(), smoke, offset=(5, 7), roi_mask=True)
+        self.assertEqual(roi.shape, smoke.shape[:2])
+        np.testing.assert_array_equal(res_mask[5:35, 7:47], roi)
+        self.assertEqual(res_mask.sum(), roi.sum())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,271 @@
+# Copyright (C) 2019-2022, Pyronear.
+
+# This program is licensed under the Apache License version 2.
+# See LICENSE or go to <https://www.apache.org/licenses/LICENSE-2.0.txt> for full license details.
+
+import filecmp
+import glob
+import os
+import subprocess
+import sys
+import tempfile
+import unittest
+from syntheticdataset.journal import Journal, journal_path
+from syntheticdataset.manifest import read_manifest
+from syntheticdataset.poisson_blending_utils import FACTORIZATION_CACHE
+from syntheticdataset.runner import (
+    assign_shard,
+    estimate_set_cost,
+    plan_all_sets,
+    plan_random_sets,
+    run_sets,
+)
+from syntheticdataset.utils import FRAME_CACHE
+
+SMOKE_VIDEOS = ["test/videos/test_smoke.mp4"]
+BACKGROUND_VIDEOS = ["test/videos/test_bg.mp4"]
+
+
+def make_tasks(root, seed, n_sets=3):
+    plan = plan_random_sets(SMOKE_VIDEOS, BACKGROUND_VIDEOS, n_sets, seed)
+    common = dict(root=root, size_max_bg=320, size_max_smoke=320, save_bbox=True)
+    return [dict(task, **common) for task in plan]
+
+
+class RunnerTester(unittest.TestCase):
+    def test_plan(self):
+        self.assertEqual(
+            plan_random_sets(SMOKE_VIDEOS, BACKGROUND_VIDEOS, 5, seed=1),
+            plan_random_sets(SMOKE_VIDEOS, BACKGROUND_VIDEOS, 5, seed=1),
+        )
+        self.assertNotEqual(
+            plan_random_sets(SMOKE_VIDEOS, BACKGROUND_VIDEOS, 5, seed=1),
+            plan_random_sets(SMOKE_VIDEOS, BACKGROUND_VIDEOS, 5, seed=2),
+        )
+        # set parameters only depend on the seed and the set index
+        self.assertEqual(
+            [
+                t["seed"]
+                for t in plan_random_sets(SMOKE_VIDEOS, BACKGROUND_VIDEOS, 5, 1)
+            ][:3],
+            [
+                t["seed"]
+                for t in plan_random_sets(SMOKE_VIDEOS, BACKGROUND_VIDEOS, 3, 1)
+            ],
+        )
+
+        plan = plan_all_sets(SMOKE_VIDEOS * 2, BACKGROUND_VIDEOS * 3, seed=1)
+        self.assertEqual([task["set_idx"] for task in plan], list(range(6)))
+
+    def test_workers(self):
+        with tempfile.TemporaryDirectory() as root:
+            roots = [os.path.join(root, str(workers)) for workers in [1, 2]]
+            for workers, out in zip([1, 2], roots):
+                run_sets(make_tasks(out, seed=0), workers=workers, progress=False)
+
+            files = sorted(
+                os.path.relpath(f, roots[0])
+                for f in glob.glob(f"{roots[0]}/**/*.*", recursive=True)
+            )
+            self.assertGreater(len(files), 0)
+            _, mismatch, errors = filecmp.cmpfiles(
+                roots[0], roots[1], files, shallow=False
+            )
+            self.assertEqual(mismatch + errors, [])
+
+    def test_cache_budgets(self):
+        FRAME_CACHE.clear()
+        FACTORIZATION_CACHE.clear()
+        with tempfile.TemporaryDirectory() as root:
+            stats = run_sets(
+                make_tasks(root, seed=0, n_sets=2),
+                frame_cache_bytes=256 * 1024**2,
+                factorization_cache_bytes=0,
+                progress=False,
+            )
+        try:
+            # the second pass over the smoke clip is a hit, background windows
+            # are not cached
+            self.assertGreater(stats["Decoded frame"]["hits"], 0)
+            self.assertEqual(
+                {key[0] for key in FRAME_CACHE._data},
+                {os.path.abspath(SMOKE_VIDEOS[0])},
+            )
+            self.assertEqual(len(FACTORIZATION_CACHE), 0)
+        finally:
+            FRAME_CACHE.max_bytes = 0
+            FRAME_CACHE.clear()
+            FACTORIZATION_CACHE.max_bytes = 256 * 1024**2
+            FACTORIZATION_CACHE.clear()
+
+    def test_resume(self):
+        with tempfile.TemporaryDirectory() as root:
+            journal = Journal(f"{root}/journal.jsonl")
+            journal.start(0)
+            tasks = make_tasks(root, seed=0, n_sets=2)
+            run_sets(tasks[:1], journal=journal, progress=False)
+
+            # a crash while appending leaves a partial line
+            with open(f"{root}/journal.jsonl", "a") as f:
+                f.write('{"set": {"smoke')
+
+            journal = Journal(f"{root}/journal.jsonl")
+            self.assertEqual(journal.seed, 0)
+            self.assertEqual(journal.pending(tasks), tasks[1:])
+            self.assertRaises(ValueError, journal.start, 1)
+            self.assertRaises(
+                ValueError, journal.pending, make_tasks(root, seed=1, n_sets=2)
+            )
+
+            journal.add(tasks[1])
+            self.assertEqual(Journal(f"{root}/journal.jsonl").pending(tasks), [])
+
+    def test_incremental_plan(self):
+        backgrounds = ["bg_a.mp4", "bg_c.mp4"]
+        done = plan_all_sets(SMOKE_VIDEOS, backgrounds, seed=1)
+
+        # sets of the previous videos are unchanged, new pairs come after them
+        plan = plan_all_sets(SMOKE_VIDEOS, backgrounds + ["bg_b.mp4"], 1, planned=done)
+        self.assertEqual([task["set_idx"] for task in plan], [0, 2, 1])
+        self.assertEqual([plan[0], plan[2]], done)
+
+    def test_resume_plan(self):
+        smokes, backgrounds = ["s0.mp4", "s1.mp4"], ["b0.mp4", "b1.mp4"]
+        with tempfile.TemporaryDirectory() as root:
+            journal = Journal(f"{root}/journal.jsonl")
+            journal.start(1)
+            plan = plan_all_sets(smokes, backgrounds, 1, planned=journal.plan.values())
+            journal.record_plan(plan)
+            # sets completed out of order by several workers
+            journal.add(plan[0])
+            journal.add(plan[2])
+
+            # unfinished sets keep their index when the run is resumed
+            journal = Journal(f"{root}/journal.jsonl")
+            resumed = plan_all_sets(
+                smokes, backgrounds, 1, planned=journal.plan.values()
+            )
+            self.assertEqual(resumed, plan)
+            self.assertEqual(journal.pending(resumed), [plan[1], plan[3]])
+
+            # new pairs are numbered after every planned set, done or not
+            journal.record_plan(resumed)
+            plan = plan_all_sets(
+                smokes + ["s2.mp4"], backgrounds, 1, planned=journal.plan.values()
+            )
+            self.assertEqual([task["set_idx"] for task in plan], [0, 1, 2, 3, 4, 5])
+            self.assertEqual(journal.pending(plan), plan[1:2] + plan[3:])
+
+    def test_shard_plans(self):
+        with tempfile.TemporaryDirectory() as root:
+            paths = [journal_path(root, 2, i) for i in range(2)]
+            first = Journal(paths[0])
+            first.record_plan(plan_all_sets(["s0.mp4"], ["b0.mp4", "b1.mp4"], 1))
+
+            # a node started later plans the sets of the first one
+            second = Journal(paths[1], others=paths)
+            plan = plan_all_sets(["s0.mp4"], ["b1.mp4"], 1, second.plan.values())
+            self.assertEqual([task["set_idx"] for task in plan], [1])
+
+            # nodes started at once from other videos
+            Journal(paths[1]).record_plan(plan_all_sets(["s1.mp4"], ["b0.mp4"], 1))
+            self.assertRaises(ValueError, Journal, paths[0], others=paths)
+
+    def test_assign_shard(self):
+        tasks = [{"set_idx": i, "cost": cost} for i, cost in enumerate([5, 1, 3, 3, 2])]
+        shards = [assign_shard(tasks, 2, i, cost=lambda t: t["cost"]) for i in range(2)]
+
+        self.assertEqual(
+            sorted(t["set_idx"] for s in shards for t in s), list(range(5))
+        )
+        self.assertEqual([sum(t["cost"] for t in s) for s in shards], [7, 7])
+        self.assertRaises(ValueError, assign_shard, tasks, 2, 2)
+
+        task = make_tasks("", seed=0, n_sets=1)[0]
+        self.assertGreater(estimate_set_cost(task), 0)
+
+    def test_nodes(self):
+        repo = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        script = os.path.join(repo, "scripts", "make_dataset.py")
+        env = dict(os.environ, PYTHONPATH=repo)
+
+        def link_videos(root, smoke_names, background_names):
+            for folder, video, names in [
+                ("smoke", SMOKE_VIDEOS[0], smoke_names),
+                ("background", BACKGROUND_VIDEOS[0], background_names),
+            ]:
+                os.makedirs(os.path.join(root, "videos", folder))
+                for name in names:
+                    os.symlink(
+                        os.path.join(repo, video),
+                        os.path.join(root, "videos", folder, name),
+                    )
+
+        def make_dataset(root, *args):
+            cmd = [sys.executable, script, "--seed", "0", *args]
+            return subprocess.Popen(
+                cmd,
+                cwd=root,
+                env=env,
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.PIPE,
+            )
+
+        with tempfile.TemporaryDirectory() as root:
+            link_videos(root, ["test_smoke.mp4"], ["test_bg.mp4"])
+
+            # one process per node, the merge fails until every shard is made
+            node = make_dataset(
+                root, "--set", "3", "--num-shards", "2", "--shard-index", "0"
+            )
+            self.assertEqual(node.wait(), 0, node.stderr.read())
+            self.assertNotEqual(make_dataset(root, "--set", "3", "--merge").wait(), 0)
+
+            nodes = [
+                make_dataset(
+                    root, "--set", "3", "--num-shards", "2", "--shard-index", str(i)
+                )
+                for i in range(2)
+            ]
+            for node in nodes:
+                self.assertEqual(node.wait(), 0, node.stderr.read())
+            self.assertEqual(make_dataset(root, "--set", "3", "--merge").wait(), 0)
+
+            records = list(read_manifest(f"{root}/pyro_dataset/manifest.jsonl"))
+            self.assertEqual(sorted({r["set_idx"] for r in records}), [0, 1, 2])
+            self.assertEqual(
+                len(records), len(glob.glob(f"{root}/pyro_dataset/images/*/*"))
+            )
+
+        with tempfile.TemporaryDirectory() as root:
+            smokes, backgrounds = ["s0.mp4", "s1.mp4"], ["b0.mp4", "b1.mp4"]
+            link_videos(root, smokes, backgrounds)
+
+            # make all sets, the second node starts once the first one is done
+            for i in range(2):
+                node = make_dataset(root, "--num-shards", "2", "--shard-index", str(i))
+                self.assertEqual(node.wait(), 0, node.stderr.read())
+            merge = make_dataset(root, "--merge")
+            self.assertEqual(merge.wait(), 0, merge.stderr.read())
+
+            # every set is made once, with the pair of the plan of the listing
+            plan = plan_all_sets(
+                [f"videos/smoke/{name}" for name in smokes],
+                [f"videos/background/{name}" for name in backgrounds],
+                seed=0,
+            )
+            records = list(read_manifest(f"{root}/pyro_dataset/manifest.jsonl"))
+            self.assertEqual(
+                {(r["set_idx"], r["smoke"], r["background"]) for r in records},
+                {
+                    (t["set_idx"], t["smoke_video_file"], t["background_file"])
+                    for t in plan
+                },
+            )
+            self.assertEqual(
+                len(records), len(glob.glob(f"{root}/pyro_dataset/images/*/*"))
+            )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,84 @@
+# Copyright (C) 2019-2022, Pyronear.
+
+# This program is licensed under the Apache License version 2.
+# See LICENSE or go to <https://www.apache.org/licenses/LICENSE-2.0.txt> for full license details.
+
+import numpy as np
+import random
+import sys
+import tempfile
+import unittest
+from syntheticdataset.make_set import get_placement, make_one_set
+from syntheticdataset.placement import PLACEMENT_CACHE
+from syntheticdataset.sky_cache import read_sky_mask, stored_frame, write_sky_masks
+from syntheticdataset.utils import iter_video
+
+
+class SkyCacheTester(unittest.TestCase):
+    def test_sky_cache(self):
+        background_file = "test/videos/test_bg.mp4"
+        h, w = next(iter_video(background_file, size_max=1280)).shape[:2]
+
+        # only the bottom quarter of the frames is ground
+        ground = np.zeros((h, w), dtype=bool)
+        ground[3 * h // 4 :] = True
+
+        with tempfile.TemporaryDirectory() as root:
+            cache = f"{root}/sky_cache"
+            write_sky_masks(
+                cache, background_file, "MiDaS_small", 1280, {0: ground, 20: ground}
+            )
+
+            self.assertIsNone(
+                read_sky_mask(cache, background_file, 0, "DPT_Large", 1280)
+            )
+            # the closest stored frame is used
+            np.testing.assert_array_equal(
+                read_sky_mask(cache, background_file, 10, "MiDaS_small", 1280), ground
+            )
+
+            make_one_set(
+                "test/videos/test_smoke.mp4",
+                background_file,
+                root=root,
+                fx=0.2,
+                fy=0.2,
+                smoke_speed=30,
+                seed=0,
+                sky_cache=cache,
+                sky_model_type="MiDaS_small",
+            )
+
+            # the smoke box is mostly on the ground
+            placement = get_placement(
+                background_file, 0, (h, w), 1280, cache, "MiDaS_small"
+            )
+            self.assertIs(
+                get_placement(background_file, 0, (h, w), 1280, cache, "MiDaS_small"),
+                placement,
+            )
+            # one placement per stored sky mask, whatever the first frame of a set
+            self.assertEqual(
+                stored_frame(cache, background_file, 12, "MiDaS_small", 1280), 0
+            )
+            self.assertIs(
+                get_placement(background_file, 12, (h, w), 1280, cache, "MiDaS_small"),
+                placement,
+            )
+            self.assertIsNot(
+                get_placement(background_file, 25, (h, w), 1280, cache, "MiDaS_small"),
+                placement,
+            )
+            PLACEMENT_CACHE.clear()
+
+        rng = random.Random(0)
+        for _ in range(20):
+            dy, dx = placement.sample(rng, (50, 40), min_fraction=0.25)
+            self.assertGreaterEqual(ground[dy : dy + 50, dx : dx + 40].mean(), 0.25)
+
+        # sets are made without the depth model
+        self.assertNotIn("torch", sys.modules)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -7,7 +7,10 @@ import unittest
 import random
 import tempfile
 import glob
+import os
+import filecmp
 from syntheticdataset.make_set import make_one_set
+from syntheticdataset.manifest import merge_manifest, read_manifest
 
 
 class SyntheticDatasetTester(unittest.TestCase):
@@ -39,6 +42,90 @@ class SyntheticDatasetTester(unittest.TestCase):
             self.assertGreater(len(glob.glob(root + "pyro_dataset/labels/train/*")), 20)
             self.assertGreater(len(glob.glob(root + "pyro_dataset/mask/train/*")), 20)
 
+    def test_random_background_window(self):
+        with tempfile.TemporaryDirectory() as root:
+
+            make_one_set(
+                "test/videos/test_smoke.mp4",
+                "test/videos/test_bg.mp4",
+                root=root + "pyro_dataset",
+                fx=0.3,
+                fy=0.3,
+                smoke_speed=10,
+                smoke_offset=0,
+                random_bg_start=True,
+            )
+
+            # at most 18 smoke frames (180 frames every 10), for each blending method
+            n_imgs = len(glob.glob(root + "pyro_dataset/images/train/*"))
+            self.assertGreater(n_imgs, 0)
+            self.assertLessEqual(n_imgs, 36)
+
+    def test_opacity(self):
+        with tempfile.TemporaryDirectory() as root:
+
+            for opacity in (0.5, 0.8):
+                make_one_set(
+                    "test/videos/test_smoke.mp4",
+                    "test/videos/test_bg.mp4",
+                    root=f"{root}/{opacity}",
+                    fx=0.3,
+                    fy=0.3,
+                    opacity=opacity,
+                    smoke_speed=30,
+                    size_max_bg=320,
+                    size_max_smoke=320,
+                    seed=0,
+                )
+
+            # the opacity of the set only applies to basic blending
+            for blending, opacity_applied in [("basic", True), ("poisson", False)]:
+                files = sorted(
+                    os.path.basename(f)
+                    for f in glob.glob(f"{root}/0.5/images/train/{blending}_*")
+                )
+                self.assertGreater(len(files), 0)
+                _, mismatch, _ = filecmp.cmpfiles(
+                    f"{root}/0.5/images/train",
+                    f"{root}/0.8/images/train",
+                    files,
+                    shallow=False,
+                )
+                self.assertEqual(mismatch, files if opacity_applied else [])
+
+    def test_manifest(self):
+        with tempfile.TemporaryDirectory() as root:
+
+            for set_idx in (1, 0):
+                make_one_set(
+                    "test/videos/test_smoke.mp4",
+                    "test/videos/test_bg.mp4",
+                    root=root,
+                    set_idx=set_idx,
+                    fx=0.3,
+                    fy=0.3,
+                    opacity=0.5,
+                    smoke_speed=10,
+                    seed=set_idx,
+                )
+
+            n_records = merge_manifest(root)
+            records = list(read_manifest(f"{root}/manifest.jsonl"))
+            self.assertEqual(len(records), n_records)
+            self.assertEqual(len(records), len(glob.glob(f"{root}/images/train/*")))
+            self.assertEqual(records[0]["set_idx"], 0)
+            for record in records:
+                self.assertTrue(os.path.isfile(os.path.join(root, record["path"])))
+
+            poisson = list(
+                read_manifest(
+                    f"{root}/manifest.jsonl", blending="poisson_blending", set_idx=1
+                )
+            )
+            self.assertEqual(len(poisson), n_records // 4)
+            self.assertEqual(poisson[0]["opacity"], 0.5)
+            self.assertEqual(poisson[0]["smoke_speed"], 10)
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,88 @@
+# Copyright (C) 2019-2022, Pyronear.
+
+# This program is licensed under the Apache License version 2.
+# See LICENSE or go to <https://www.apache.org/licenses/LICENSE-2.0.txt> for full license details.
+
+import tempfile
+import types
+import unittest
+import numpy as np
+from syntheticdataset.cache import LRUCache
+from syntheticdataset.frame_store import open_store
+from syntheticdataset.utils import (
+    export_video,
+    iter_video,
+    read_video,
+    select_keyframes,
+    video_frames,
+    _frames_nbytes,
+)
+
+
+class VideoReaderTester(unittest.TestCase):
+    def test_iter_video(self):
+        smoke_video_file = "test/videos/test_smoke.mp4"
+
+        self.assertIsInstance(iter_video(smoke_video_file), types.GeneratorType)
+
+        imgs = read_video(smoke_video_file, size_max=320)
+        self.assertEqual(max(imgs[0].shape), 320)
+
+        strided = read_video(smoke_video_file, size_max=320, start=20, stride=7)
+        self.assertEqual(len(strided), len(imgs[20::7]))
+        for img, ref in zip(strided, imgs[20::7]):
+            np.testing.assert_array_equal(img, ref)
+
+        limited = read_video(smoke_video_file, size_max=320, stride=3, max_frames=4)
+        self.assertEqual(len(limited), 4)
+
+    def test_frame_cache(self):
+        smoke_video_file = "test/videos/test_smoke.mp4"
+        cache = LRUCache(64 * 1024**2, sizeof=_frames_nbytes)
+
+        imgs = read_video(smoke_video_file, size_max=160, stride=5, cache=cache)
+        cached = read_video(smoke_video_file, size_max=160, stride=5, cache=cache)
+        self.assertEqual(cache.stats()["hits"], 1)
+        self.assertEqual(cache.nbytes, _frames_nbytes(imgs))
+        self.assertIs(cached[0], imgs[0])
+        self.assertFalse(cached[0].flags.writeable)
+
+        # a different stride is another entry
+        read_video(smoke_video_file, size_max=160, stride=6, cache=cache)
+        self.assertEqual(cache.stats()["misses"], 2)
+
+    def test_frame_store(self):
+        smoke_video_file = "test/videos/test_smoke.mp4"
+        imgs = read_video(smoke_video_file, size_max=160, start=3, stride=4)
+
+        with tempfile.TemporaryDirectory() as store:
+            self.assertIsNone(open_store(store, smoke_video_file, 160))
+            export_video(smoke_video_file, store, size_max=160)
+
+            stored = list(
+                video_frames(
+                    smoke_video_file, size_max=160, start=3, stride=4, store=store
+                )
+            )
+            self.assertEqual(len(stored), len(imgs))
+            self.assertIsInstance(stored[0].base, np.memmap)
+            for img, ref in zip(stored, imgs):
+                np.testing.assert_array_equal(img, ref)
+
+            # other sizes are not stored
+            self.assertIsNone(open_store(store, smoke_video_file, 320))
+
+    def test_select_keyframes(self):
+        rng = np.random.RandomState(0)
+        scene = rng.randint(0, 255, (72, 128, 3), dtype=np.uint8)
+        noise = [rng.randint(-2, 3, scene.shape) for _ in range(10)]
+        frames = [np.clip(scene + n, 0, 255).astype(np.uint8) for n in noise]
+        # the camera moved at frame 6
+        frames[6:] = [np.roll(frame, 20, axis=1) for frame in frames[6:]]
+
+        self.assertEqual(select_keyframes(frames, threshold=8.0), [0, 6])
+        self.assertEqual(select_keyframes(frames, max_interval=4), [0, 4, 6])
+
+
+if __name__ == "__main__":
+    unittest.main()
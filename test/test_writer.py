@@ -0,0 +1,85 @@
+# Copyright (C) 2019-2022, Pyronear.
+
+# This program is licensed under the Apache License version 2.
+# See LICENSE or go to <https://www.apache.org/licenses/LICENSE-2.0.txt> for full license details.
+
+import cv2
+import glob
+import numpy as np
+import os
+import tarfile
+import tempfile
+import unittest
+from syntheticdataset.writer import (
+    AsyncWriter,
+    ShardWriter,
+    encode_params,
+    remove_temp_files,
+    temp_path,
+    write_shard_index,
+)
+
+
+class AsyncWriterTester(unittest.TestCase):
+    def test_write(self):
+        img = np.random.RandomState(0).randint(0, 255, (32, 48, 3), dtype=np.uint8)
+
+        with tempfile.TemporaryDirectory() as root:
+            with AsyncWriter(workers=2, max_pending=2) as writer:
+                for i in range(10):
+                    writer.save_img(f"{root}/images", f"{i}.png", img)
+                    writer.save_label(f"{root}/labels", f"{i}.txt", str(i))
+                writer.flush()
+
+                self.assertEqual(len(os.listdir(f"{root}/images")), 10)
+                self.assertEqual(temp_path("a/0.png"), "a/.0.png.tmp")
+                np.testing.assert_array_equal(cv2.imread(f"{root}/images/9.png"), img)
+                with open(f"{root}/labels/3.txt") as f:
+                    self.assertEqual(f.read(), "3")
+
+            # errors are raised when flushing
+            writer = AsyncWriter(workers=2)
+            writer.save_img(f"{root}/images", "bad.unknown_extension", img)
+            self.assertRaises(Exception, writer.close)
+
+            # leftovers of interrupted writes are hidden from the dataset globs
+            for name in ["1.png", "2.txt"]:
+                open(temp_path(f"{root}/images/{name}"), "w").close()
+            self.assertEqual(len(glob.glob(f"{root}/images/*")), 10)
+            remove_temp_files(f"{root}/images", "1*")
+            self.assertEqual(
+                sorted(os.listdir(f"{root}/images"))[:2], [".2.txt.tmp", "0.png"]
+            )
+
+    def test_shards(self):
+        img = np.random.RandomState(0).randint(0, 255, (32, 48, 3), dtype=np.uint8)
+
+        with tempfile.TemporaryDirectory() as root:
+            with AsyncWriter(workers=2) as writer:
+                shards = ShardWriter(
+                    f"{root}/shards/set_{{:04}}.tar",
+                    writer,
+                    maxcount=4,
+                    params={"png": encode_params("png", 1)},
+                )
+                for i in range(10):
+                    shards.save_sample(f"{i:04}", {"png": img, "txt": str(i)})
+                self.assertEqual(
+                    [shard["nsamples"] for shard in shards.close()], [4, 4, 2]
+                )
+
+            index = write_shard_index(f"{root}/shards")
+            self.assertEqual(index["shardlist"][1]["url"], "set_0001.tar")
+            self.assertEqual(sum(shard["nsamples"] for shard in index["shardlist"]), 10)
+
+            # samples are stored in submission order
+            with tarfile.open(f"{root}/shards/set_0001.tar") as tar:
+                self.assertEqual(tar.getnames()[:2], ["0004.png", "0004.txt"])
+                data = tar.extractfile("0005.png").read()
+                self.assertEqual(tar.extractfile("0005.txt").read(), b"5")
+            decoded = cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_COLOR)
+            np.testing.assert_array_equal(decoded, img)
+
+
+if __name__ == "__main__":
+    unittest.main()